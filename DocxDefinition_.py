@@ -1,6 +1,5 @@
 import json, re, os, io, base64
 import hashlib
-from PIL import Image
 from datetime import datetime
 from enum import Enum
 
@@ -12,6 +11,10 @@ from docx.oxml import OxmlElement
 from docx.oxml.ns import qn
 
 from modules.block_tree import format_node_number  # 階層編號（spec §5）
+from docx_cache import load_template, protection_hash, load_image
+from config import DOCX_PROTECTION
+
+DEFAULT_PROTECTION_PASSWORD = "1q2w3e4RR"  # DOCX_PROTECTION_PASSWORD 未設定時使用
 
 COLOR_DICT = {
     "red": RGBColor(255, 0, 0),
@@ -690,39 +693,29 @@ def _fill_docx_cell_from_tiptap(docx_cell, cell_data, COLOR_DICT, center = True)
                 if src.startswith('http'):
                     local_src = src.split("/", 3)[-1]
                     
-                    # 嘗試打開本地圖片，取得真實尺寸
-                    try:
-                        with Image.open(local_src) as img:
-                            dpi = img.info.get('dpi', (96, 96))
-                            natural_width_cm = (img.width / dpi[0]) * 2.54
-                        # 核心邏輯：取「原圖寬度」與「儲存格最大容許寬度」中較小的值
-                        final_width_cm = min(natural_width_cm, cell_max_width_cm)
-                    except Exception:
-                        # 若讀取失敗，就安全地降級使用最大容許寬度
-                        final_width_cm = cell_max_width_cm
-                        
-                    if os.path.exists(local_src):
-                        run.add_picture(local_src, width=Cm(final_width_cm))   # 防呆：圖檔不存在則略過
+                    # 取真實尺寸（docx_cache：同一張圖檔沒變就不再重讀 / 重開）
+                    img = load_image(local_src)
+                    if img is not None:   # 防呆：圖檔不存在則略過
+                        try:
+                            natural_width_cm = (img.width / img.dpi[0]) * 2.54
+                            # 核心邏輯：取「原圖寬度」與「儲存格最大容許寬度」中較小的值
+                            final_width_cm = min(natural_width_cm, cell_max_width_cm)
+                        except Exception:
+                            # 若讀取失敗，就安全地降級使用最大容許寬度
+                            final_width_cm = cell_max_width_cm
+                        run.add_picture(img.stream(), width=Cm(final_width_cm))
                     
                 elif src.startswith('data:image'):
-                    base64_data = src.split(",", 1)[-1]
-                    image_bytes = base64.b64decode(base64_data)
-                    image_stream = io.BytesIO(image_bytes)
-                    
-                    with Image.open(image_stream) as img:
-                        # 網頁截圖通常預設為 96 DPI
-                        dpi = img.info.get('dpi', (96, 96))
-                        # 算出圖片原本「真實」的物理寬度 (公分)
-                        natural_width_cm = (img.width / dpi[0]) * 2.54
-                    
-                    # 讀完尺寸後，必須把記憶體檔案指標歸零
-                    image_stream.seek(0)
-                    
+                    # base64 解碼 + 讀尺寸走 docx_cache（同一張圖不重複解碼）
+                    img = load_image(src)
+                    # 網頁截圖通常預設為 96 DPI；算出圖片原本「真實」的物理寬度 (公分)
+                    natural_width_cm = (img.width / img.dpi[0]) * 2.54
+
                     # 核心邏輯：取「原圖寬度」與「儲存格最大容許寬度」中較小的值
                     final_width_cm = min(natural_width_cm, cell_max_width_cm)
-                    
+
                     # 寫入 Word
-                    run.add_picture(image_stream, width=Cm(final_width_cm))
+                    run.add_picture(img.stream(), width=Cm(final_width_cm))
 
 
 def create_docx_table(cell, json_table_data):
@@ -1286,7 +1279,8 @@ def create_process_table(cell, content_data):
         p = cell.add_paragraph()
         p.alignment = WD_ALIGN_PARAGRAPH.CENTER
         run = p.add_run()
-        run.add_picture(f'uploads/{src}', width = Cm(width - 1))
+        img = load_image(f'uploads/{src}')   # 檔案不存在照舊由 add_picture 丟錯
+        run.add_picture(img.stream() if img else f'uploads/{src}', width = Cm(width - 1))
         return
         
     if type(content_data.get('table_json')) != dict or content_data['table_json'].get('content') == None or len(content_data['table_json']['content']) == 0:
@@ -1369,39 +1363,28 @@ def parse_json_content(parent_object, json_data, indent = None, header = False,
                     if src.startswith('http'):
                         local_src = src.split("/", 3)[-1]
                         
+                        img = load_image(local_src)
                         try:
-                            with Image.open(local_src) as img:
-                                dpi = img.info.get('dpi', (96, 96))
-                                # 邏輯：取「圖片原像素」與「600 像素」中較小的那個
-                                target_px = min(img.width, MAX_PIXELS)
-                                # 將像素轉換為 Word 認識的公分 (cm)
-                                target_width_cm = (target_px / dpi[0]) * 2.54
-                                
+                            # 邏輯：取「圖片原像素」與「600 像素」中較小的那個，再轉成 Word 認識的公分 (cm)
+                            target_px = min(img.width, MAX_PIXELS)
+                            target_width_cm = (target_px / img.dpi[0]) * 2.54
                         except Exception as e:
                             print(f"Warning: 無法讀取本地圖片尺寸 {local_src}, error: {e}")
                             # 防呆：萬一讀不到，就給標準的 600px 轉換值 (約 15.875 公分)
                             target_width_cm = (MAX_PIXELS / 96) * 2.54
-                            
+
                         # 寫入 Word
-                        if os.path.exists(local_src):
-                            run.add_picture(local_src, width=Cm(target_width_cm))   # 防呆：圖檔不存在則略過
+                        if img is not None:
+                            run.add_picture(img.stream(), width=Cm(target_width_cm))   # 防呆：圖檔不存在則略過
                         
                     elif src.startswith('data:image'):
                         # 處理 Base64 圖片
-                        base64_data = src.split(",", 1)[-1]
-                        image_bytes = base64.b64decode(base64_data)
-                        image_stream = io.BytesIO(image_bytes)
-                        
-                        with Image.open(image_stream) as img:
-                            dpi = img.info.get('dpi', (96, 96))
-                            target_px = min(img.width, MAX_PIXELS)
-                            target_width_cm = (target_px / dpi[0]) * 2.54
-                        
-                        # 讀完尺寸後，必須把記憶體檔案指標歸零
-                        image_stream.seek(0)
-                        
+                        img = load_image(src)   # base64 解碼 + 讀尺寸走 docx_cache
+                        target_px = min(img.width, MAX_PIXELS)
+                        target_width_cm = (target_px / img.dpi[0]) * 2.54
+
                         # 寫入 Word
-                        run.add_picture(image_stream, width=Cm(target_width_cm))
+                        run.add_picture(img.stream(), width=Cm(target_width_cm))
 
                 elif item.get("type") == "image":
                     src = item["attrs"]["src"]
@@ -1410,21 +1393,13 @@ def parse_json_content(parent_object, json_data, indent = None, header = False,
                         local_src = src.split("/", 3)[-1]
                         # 以目前 cell 寬度大概估一下圖片寬度
                         cell_width_cm = parent_object.width.cm if hasattr(parent_object, "width") else 4
-                        if os.path.exists(local_src):
-                            run.add_picture(local_src, width=Cm(max(cell_width_cm - 0.5, 0.5)))   # 防呆：圖檔不存在則略過
+                        img = load_image(local_src)
+                        if img is not None:
+                            run.add_picture(img.stream(), width=Cm(max(cell_width_cm - 0.5, 0.5)))   # 防呆：圖檔不存在則略過
                     elif src.startswith('data:image'):
                         # 處理 Base64 圖片 (格式通常是 "data:image/png;base64,iVBORw0K...")
-                        # 1. 用逗號切開，取得後面的純 base64 字串
-                        base64_data = src.split(",", 1)[-1]
-                        
-                        # 2. 將 base64 字串解碼成二進位位元組 (bytes)
-                        image_bytes = base64.b64decode(base64_data)
-                        
-                        # 3. 包裝成 BytesIO (記憶體中的檔案物件)
-                        image_stream = io.BytesIO(image_bytes)
-                        
-                        # 4. 直接塞入 Word，不特別設定長寬，讓它維持原始比例
-                        run.add_picture(image_stream)
+                        # 直接塞入 Word，不特別設定長寬，讓它維持原始比例（base64 解碼走 docx_cache）
+                        run.add_picture(load_image(src).stream())
 
 
             p.alignment = WD_ALIGN_PARAGRAPH.LEFT
@@ -1477,7 +1452,8 @@ def createPictures(cell, content_obj):
                 p.alignment = WD_ALIGN_PARAGRAPH.CENTER
                 src = file_info["path_to_save"].split("/", 1)[-1]
                 run = p.add_run()
-                run.add_picture(f'uploads/temp/{src}', width = Cm(width - 1))
+                img = load_image(f'uploads/temp/{src}')   # 檔案不存在照舊由 add_picture 丟錯
+                run.add_picture(img.stream() if img else f'uploads/temp/{src}', width = Cm(width - 1))
 
 def createTable(cell, content_obj):
     """ct=2 單表渲染（table_json 內含一個 tiptap table）。參數表(ct=4)走 create_parameter_table，不經此。"""
@@ -1698,14 +1674,17 @@ def generate_word_password_hash(password, spin_count=100000):
     
     return salt_b64, hash_b64
 
-def enable_docx_protection(doc, password):
+def enable_docx_protection(doc, password=None):
     """
     直接修改 python-docx 的 document 物件，注入保護設定與密碼驗證參數。
+    salt/hash 走 docx_cache 快取（同密碼每個行程只算一次），密碼 / spin count 見 config.DOCX_PROTECTION。
     """
     settings_element = doc.settings.element
+    password = password or DOCX_PROTECTION["password"] or DEFAULT_PROTECTION_PASSWORD
+    spin_count = DOCX_PROTECTION["spin_count"]
 
     # 取得符合 Word 標準的 salt 與 hash
-    salt_value, hash_value = generate_word_password_hash(password)
+    salt_value, hash_value = protection_hash(password, spin_count, generate_word_password_hash, DOCX_PROTECTION["rotate_seconds"])
 
     protection = OxmlElement('w:documentProtection')
     
@@ -1718,7 +1697,7 @@ def enable_docx_protection(doc, password):
     protection.set(qn('w:cryptAlgorithmClass'), 'hash')
     protection.set(qn('w:cryptAlgorithmType'), 'typeAny')
     protection.set(qn('w:cryptAlgorithmSid'), '14') # 14 代表 SHA-512
-    protection.set(qn('w:cryptSpinCount'), '100000')
+    protection.set(qn('w:cryptSpinCount'), str(spin_count))
     
     # ★ 關鍵修正：必須同時寫入 salt 與 hash
     protection.set(qn('w:salt'), salt_value)
@@ -1732,10 +1711,14 @@ def enable_docx_protection(doc, password):
     # 寫入新標籤
     settings_element.append(protection)
 
-def fill_from_template(template_path, out_path, data, title_mapping, info_mapping, styled_mapping=None):
-    doc = Document(template_path)
+def _prepare_template(doc):
+    """範本載入時只做一次的前置處理（結果隨範本一起快取在 docx_cache）。"""
     apply_default_fonts(doc, latin="Arial", east_asia="標楷體")
 
+def fill_from_template(template_path, out_path, data, title_mapping, info_mapping, styled_mapping=None, protect=True):
+    # 範本解析一次後快取，這裡拿到的是獨立複本（已套好預設字型）
+    doc = load_template(template_path, prepare=_prepare_template)
+
     # 產生內容（影響頁數）
     draw_instruction_content(doc, data)
 
@@ -1755,9 +1738,18 @@ def fill_from_template(template_path, out_path, data, title_mapping, info_mappin
     # ★ 內容都產生完之後，再插入頁碼欄位
     setup_page_numbers(doc)
 
-    enable_docx_protection(doc, "1q2w3e4RR")
+    # 即看即丟的預覽（protect=False）不加保護
+    if protect:
+        enable_docx_protection(doc)
 
+    # out_path 可以是檔案路徑或可寫入的 stream；None → 存進記憶體回傳 BytesIO（預覽直接串流給前端，不落地）
+    if out_path is None:
+        buf = io.BytesIO()
+        doc.save(buf)
+        buf.seek(0)
+        return buf
     doc.save(out_path)
+    return out_path
 
 _code_prefix_re = re.compile(r"^\s*\(([^)]+)\)\s*(.*)$")
 
@@ -1771,7 +1763,7 @@ def clean_process_name(raw: str) -> str:
     m = _code_prefix_re.match(raw)
     return m.group(2).strip() if m else raw
 
-def get_docx_(outpath, data, template = "docx-template/example3.docx"):
+def get_docx_(outpath, data, template = "docx-template/example3.docx", protect=True):
     attribute = data["attribute"][-1]
     Doc_id = attribute["document_id"]
     # 制定日期：預覽快照時帶入「當初產生文件的日期」(data["render_date"])；產生 Word / 即時預覽則用 now()
@@ -1831,7 +1823,7 @@ def get_docx_(outpath, data, template = "docx-template/example3.docx"):
         info_mapping[f"POINT{index + 1}"] = f'變更要點\n{attr["change_summary"]}'
 
     # Assuming 'example__.docx' exists in the execution environment
-    fill_from_template(template, outpath, data, title_mapping, info_mapping, styled_mapping)
+    return fill_from_template(template, outpath, data, title_mapping, info_mapping, styled_mapping, protect=protect)
 
 # ----------------- Example usage -----------------
 if __name__ == "__main__":
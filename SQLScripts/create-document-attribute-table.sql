@@ -27,4 +27,6 @@ CREATE TABLE `rms_document_attributes` (
 ) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_0900_ai_ci;
 
 ALTER TABLE `rms_document_attributes` ADD COLUMN `create_date` DATETIME DEFAULT CURRENT_TIMESTAMP;
-ALTER TABLE `rms_document_attributes` MODIFY COLUMN `document_name` VARCHAR(200);
\ No newline at end of file
+ALTER TABLE `rms_document_attributes` MODIFY COLUMN `document_name` VARCHAR(200);
+-- 存檔內容 hash（save-instruction / save-specification / save-all）：與上次相同就跳過 block / reference / form_attribute 寫入
+ALTER TABLE `rms_document_attributes` ADD COLUMN `content_hash` CHAR(64) NULL;
@@ -54,3 +54,30 @@ CREATE TABLE IF NOT EXISTS `rms_asset_links` (
     ON DELETE CASCADE
 ) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4;
 
+
+-- 上傳圖片正規化（image_normalize.py）：衍生檔（*.norm.<ext>）另存一筆，指回原檔
+ALTER TABLE `rms_assets`
+  ADD COLUMN `variant`         VARCHAR(16) NOT NULL DEFAULT 'original',   -- original / normalized
+  ADD COLUMN `source_asset_id` CHAR(36)    NULL,                          -- 衍生檔 → 原檔 asset_id
+  ADD COLUMN `width_px`        INT         NULL,
+  ADD COLUMN `height_px`       INT         NULL,
+  ADD KEY `ix_asset_source` (`source_asset_id`),
+  ADD CONSTRAINT `fk_asset_source`
+    FOREIGN KEY (`source_asset_id`)
+    REFERENCES `rms_assets` (`asset_id`)
+    ON DELETE CASCADE;
+
+-- 上傳檔 content-addressed 儲存（asset_store.py）：同內容只存一份，以 SHA-256 去重
+-- 舊的 uploads/temp/YYYY/MM/DD 檔案 content_hash 為 NULL（不列入 GC）
+ALTER TABLE `rms_assets`
+  ADD COLUMN `content_hash` CHAR(64) NULL,
+  ADD UNIQUE KEY `ux_asset_hash` (`content_hash`);
+
+-- 參照計數：草稿 block 的連結帶 document_token + content_id；快照的連結只帶 snapshot_id（刪草稿不影響快照）
+ALTER TABLE `rms_asset_links`
+  ADD COLUMN `snapshot_id` BIGINT UNSIGNED NULL AFTER `content_id`,
+  ADD KEY `ix_link_snapshot` (`snapshot_id`),
+  ADD CONSTRAINT `fk_link_snapshot`
+    FOREIGN KEY (`snapshot_id`)
+    REFERENCES `rms_document_snapshots` (`snapshot_id`)
+    ON DELETE CASCADE;
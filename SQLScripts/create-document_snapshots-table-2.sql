@@ -40,4 +40,34 @@ CREATE TABLE `rms_document_snapshot_payloads` (
   `form_attributes` json DEFAULT NULL,
   PRIMARY KEY (`snapshot_id`),
   CONSTRAINT `fk_snapshot_payload_snapshot` FOREIGN KEY (`snapshot_id`) REFERENCES `rms_document_snapshots` (`snapshot_id`) ON DELETE CASCADE
-) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_0900_ai_ci
\ No newline at end of file
+) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_0900_ai_ci;
+
+-- 快照 payload 壓縮格式（modules/snapshot_codec.py）：新快照只寫 payload_blob，JSON 欄留 NULL；
+-- 舊快照 payload_blob 為 NULL，照舊讀 JSON 欄
+ALTER TABLE `rms_document_snapshot_payloads`
+  ADD COLUMN `payload_blob` LONGBLOB NULL AFTER `form_attributes`,
+  MODIFY `document_row` json NULL,
+  MODIFY `blocks_rows` json NULL,
+  MODIFY `references_rows` json NULL,
+  MODIFY `program_codes_rows` json NULL;
+
+-- 快照區塊去重（SNAPSHOT_BLOCK_DEDUP）：區塊內容（header / content / table JSON、files、metadata）以 sha256 存一次，
+-- payload_blob（envelope version 2）只記每個區塊的結構欄（content_id / parent_id / sort_order / depth ...）+ payload_hash
+-- 回收：rms_snapshot_block_refs（下面）記每個快照用到的 hash，沒有參照的由 sync_eip 全量輪刪掉（snapshot_codec.collect_payloads）
+CREATE TABLE IF NOT EXISTS `rms_block_payloads` (
+  `payload_hash` char(64)     NOT NULL,
+  `payload`      json         NOT NULL,
+  `byte_size`    int unsigned NOT NULL,
+  `created_at`   datetime     NOT NULL DEFAULT CURRENT_TIMESTAMP,
+  PRIMARY KEY (`payload_hash`)
+) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_0900_ai_ci;
+
+-- 快照 ↔ 區塊內容參照（快照刪掉 → 參照跟著 CASCADE，內容沒人用就能回收）
+-- 上線前已存在的 version 2 快照沒有參照列：collect_payloads 第一次跑時會解 envelope 補上，再開始刪
+CREATE TABLE IF NOT EXISTS `rms_snapshot_block_refs` (
+  `snapshot_id`  bigint unsigned NOT NULL,
+  `payload_hash` char(64)        NOT NULL,
+  PRIMARY KEY (`snapshot_id`, `payload_hash`),
+  KEY `ix_block_refs_hash` (`payload_hash`),
+  CONSTRAINT `fk_block_refs_snapshot` FOREIGN KEY (`snapshot_id`) REFERENCES `rms_document_snapshots` (`snapshot_id`) ON DELETE CASCADE
+) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_0900_ai_ci;
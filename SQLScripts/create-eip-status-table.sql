@@ -0,0 +1,35 @@
+-- =====================================================================
+-- rms_eip_status
+--   IDBUSER.RMS_DCC2EIP 的狀態鏡像（以 rms_id 為 key），/docs/submitted-and-rejected 只查 MySQL
+--     建快照（寫 Oracle 成功）→ 先放一筆空狀態（清單顯示「已下載」）
+--     sync_eip 每輪 → 本輪讀到的列 + 清單上狀態未定（NULL / 審核中）的列回 Oracle 補查後寫入
+--     全量輪 → 快照已刪的列清掉
+--   沒有這筆 = Oracle 查不到（清單顯示「同步失敗」）
+-- =====================================================================
+
+CREATE TABLE IF NOT EXISTS `rms_eip_status` (
+  `rms_id`           VARCHAR(120) NOT NULL,
+  `eip_no`           VARCHAR(64)  DEFAULT NULL,
+  `eip_status`       VARCHAR(32)  DEFAULT NULL COMMENT 'NULL = 尚未送審（已下載）',
+  `eip_createdt`     DATETIME     DEFAULT NULL,
+  `decision_user`    VARCHAR(64)  DEFAULT NULL,
+  `decision_comment` TEXT         DEFAULT NULL,
+  `synced_at`        DATETIME     NOT NULL DEFAULT CURRENT_TIMESTAMP,
+  PRIMARY KEY (`rms_id`),
+  KEY `ix_eip_status` (`eip_status`)
+) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4;
+
+-- 每份文件最新的快照（建快照時寫入；快照被刪 → FK 設 NULL，sync_eip 刪快照的同一個交易內重新指向剩下最新的一筆（全量輪再整體對帳））
+ALTER TABLE `rms_document_attributes`
+  ADD COLUMN `latest_snapshot_id` BIGINT UNSIGNED DEFAULT NULL,
+  ADD KEY `ix_latest_snapshot` (`latest_snapshot_id`),
+  ADD CONSTRAINT `fk_attr_latest_snapshot`
+    FOREIGN KEY (`latest_snapshot_id`)
+    REFERENCES `rms_document_snapshots` (`snapshot_id`)
+    ON DELETE SET NULL;
+
+-- 既有資料回填（rms_eip_status 不用手動回填：下一輪 sync_eip 會把鏡像沒有的 rms_id 回 Oracle 補查）
+UPDATE rms_document_attributes AS a
+JOIN (SELECT document_token, MAX(snapshot_id) AS latest_id FROM rms_document_snapshots GROUP BY document_token) AS l
+  ON l.document_token = a.document_token
+SET a.latest_snapshot_id = l.latest_id;
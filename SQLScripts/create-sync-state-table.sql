@@ -0,0 +1,36 @@
+-- =====================================================================
+-- rms_sync_state
+--   背景同步作業的進度（sync_state.py），一個作業一筆
+--     sync_name    = 'eip'（sync_eip）
+--     watermark    = 上一輪「整輪成功」的開始時間（Oracle SYSDATE），下一輪增量只讀 watermark - lookback 之後的異動
+--     last_full_at = 上一次全量對帳時間（超過 SYNC_EIP_FULL_INTERVAL 秒就再跑一次全量）
+--   刪掉該列 = 下一輪強制全量
+-- =====================================================================
+
+CREATE TABLE IF NOT EXISTS `rms_sync_state` (
+  `sync_name`    VARCHAR(32) NOT NULL,
+  `watermark`    DATETIME    DEFAULT NULL,
+  `last_full_at` DATETIME    DEFAULT NULL,
+  `updated_at`   DATETIME    NOT NULL DEFAULT CURRENT_TIMESTAMP ON UPDATE CURRENT_TIMESTAMP,
+  PRIMARY KEY (`sync_name`)
+) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4;
+
+-- 排程器指標 / 手動觸發 / leader（sync_scheduler.py，GET /system/sync 讀）
+ALTER TABLE `rms_sync_state`
+  ADD COLUMN `last_started_at`      DATETIME     DEFAULT NULL,
+  ADD COLUMN `last_finished_at`     DATETIME     DEFAULT NULL,
+  ADD COLUMN `last_duration_ms`     INT UNSIGNED DEFAULT NULL,
+  ADD COLUMN `last_status`          VARCHAR(16)  DEFAULT NULL COMMENT 'ok / error',
+  ADD COLUMN `last_error`           TEXT         DEFAULT NULL,
+  ADD COLUMN `last_result`          JSON         DEFAULT NULL COMMENT 'sync_eip 回應：mode / rows / signed / invalid / rejected / submitted / signed_chunks',
+  ADD COLUMN `consecutive_failures` INT UNSIGNED NOT NULL DEFAULT 0,
+  ADD COLUMN `total_runs`           INT UNSIGNED NOT NULL DEFAULT 0,
+  ADD COLUMN `total_errors`         INT UNSIGNED NOT NULL DEFAULT 0,
+  ADD COLUMN `trigger_requested_at` DATETIME     DEFAULT NULL COMMENT 'POST /system/sync/trigger；leader 取走後清 NULL',
+  ADD COLUMN `leader`               VARCHAR(128) DEFAULT NULL COMMENT '持有 leader lease 的 host:pid',
+  ADD COLUMN `leader_heartbeat_at`  DATETIME     DEFAULT NULL;
+
+-- Oracle 端（IDBUSER.RMS_DCC2EIP）建議索引：增量查詢以 RMS_DCCNO 限縮視窗函數範圍、以時間欄挑出異動列
+-- CREATE INDEX IX_RMS_DCC2EIP_DCCNO ON IDBUSER.RMS_DCC2EIP (RMS_DCCNO, RMS_VER);
+-- CREATE INDEX IX_RMS_DCC2EIP_INSDT ON IDBUSER.RMS_DCC2EIP (RMS_INSDT);
+-- CREATE INDEX IX_RMS_DCC2EIP_EIPDT ON IDBUSER.RMS_DCC2EIP (EIP_CREATEDT);
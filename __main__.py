@@ -1,11 +1,14 @@
 # __main__.py
 import os
-from multiprocessing import Process
+import multiprocessing
 
 from app import create_app
-from sync_worker import sync_loop
+from config import SYNC_SCHEDULER
+from sync_scheduler import run as run_sync_scheduler
 
-app = create_app()
+# render worker 以 spawn 啟動時會把本檔當 __mp_main__ 重新 import，子行程不需要建 app
+if __name__ != "__mp_main__":
+    app = create_app()
 
 if __name__ == "__main__":
     # # 🔥 避免 Flask debug reloader 啟兩次 worker：
@@ -21,15 +24,19 @@ if __name__ == "__main__":
     # #     should_start_worker = True
 
     # if should_start_worker:
-    #     worker = Process(target=sync_loop, kwargs={"interval_seconds": 14400})
+    #     worker = Process(target=run_sync_scheduler, kwargs={"interval_seconds": 14400})
     #     worker.daemon = True  # 👈 daemon: 主程式結束時自動跟著關掉
     #     worker.start()
     #     print(f"[main] sync_eip worker started (pid={worker.pid})")
 
-    worker = Process(target=sync_loop, kwargs={"interval_seconds": 1200})
-    worker.daemon = True  # 👈 daemon: 主程式結束時自動跟著關掉
-    worker.start()
-    print(f"[main] sync_eip worker started (pid={worker.pid})")
+    # 排程器有 leader lease，就算另外也跑了 python sync_scheduler.py 也只有一個會真的同步；
+    # 正式環境（多 worker WSGI）設 SYNC_SCHEDULER_EMBEDDED=0，排程器單獨部署
+    # 用 spawn 不用 fork：上面 create_app() 已經暖好 Oracle thick-mode pool，OCI handle 不能跨 fork 共用
+    if SYNC_SCHEDULER["embedded"]:
+        worker = multiprocessing.get_context("spawn").Process(target=run_sync_scheduler)
+        worker.daemon = True  # 👈 daemon: 主程式結束時自動跟著關掉
+        worker.start()
+        print(f"[main] sync scheduler started (pid={worker.pid})")
 
     # 啟動 Flask dev server
     app.run("0.0.0.0", 2150, debug=True)
@@ -1,12 +1,14 @@
 from flask import Flask
 from flask_cors import CORS
 import os
-from config import TEMP_ROOT_DIR
+from config import TEMP_ROOT_DIR, ORACLE_POOL_WARMUP
+from db import init_app as init_db
 
 def create_app():
     app = Flask(__name__)
     CORS(app, supports_credentials=True, expose_headers=["X-Document-ID"])
     os.makedirs(TEMP_ROOT_DIR, exist_ok=True)
+    init_db(app)   # request 範圍的 MySQL 連線：after_request commit / teardown 歸還
 
     # blueprints
     from modules.auth_bp import bp as auth_bp
@@ -18,6 +20,8 @@ def create_app():
     from modules.parameters import bp as parameters_bp
     from modules.dcc import bp as dcc_bp   # ⬅️ 新增這行
     from modules.department import bp as department_bp   # ⬅️ 新增這行
+    from modules.system import bp as system_bp
+    from modules.render import bp as render_bp
 
     app.register_blueprint(auth_bp, url_prefix="/api")
     app.register_blueprint(docs_bp, url_prefix="/docs")
@@ -28,5 +32,12 @@ def create_app():
     app.register_blueprint(parameters_bp, url_prefix="/parameters")
     app.register_blueprint(dcc_bp, url_prefix="/dcc")  # ⬅️ 新增這行
     app.register_blueprint(department_bp, url_prefix="/department")  # ⬅️ 新增這行
+    app.register_blueprint(system_bp, url_prefix="/system")
+    app.register_blueprint(render_bp, url_prefix="/render")
+
+    # Oracle pool 先建好，不讓第一個 request 付 thick client 初始化 + 建池成本
+    if ORACLE_POOL_WARMUP:
+        from oracle_db import warmup_pools
+        print(f"[oracle pool] warmup: {warmup_pools()}")
 
     return app
@@ -0,0 +1,236 @@
+# asset_store.py
+#
+# 上傳檔 content-addressed 儲存：檔名 = 內容 SHA-256（uploads/temp/cas/<前 2 碼>/<sha256>.<ext>），
+# 同一張圖貼進多份文件、每次變版重傳都只存一份；rms_assets 以 content_hash 去重。
+#
+# 參照計數：rms_asset_links 一筆 = 某份草稿的某個 block（或某個快照）用到這個 asset。
+#   - 存檔 / 變版 / 簽核寫回 → sync_asset_links(cur, token) 依 rms_block_content 重建該 token 的連結
+#   - 建快照 → link_snapshot_assets()（document_token 留 NULL，刪草稿不會連帶刪掉快照的參照）
+#   - collect_garbage()：沒有任何連結、超過寬限期的 CAS 檔 → 刪 rms_assets（衍生檔 row 跟著 CASCADE）+ 刪檔
+# 舊的 uploads/temp/YYYY/MM/DD 檔案（content_hash 為 NULL）不列入 GC。
+
+import os
+import re
+import time
+import uuid
+import hashlib
+import tempfile
+
+from config import UPLOAD_ROOT_DIR, TEMP_ROOT_DIR, ASSET_GC_GRACE_SECONDS
+from db import db
+from image_normalize import normalized_path
+
+CAS_DIR = os.path.join(TEMP_ROOT_DIR, "cas")
+_CHUNK = 1024 * 1024
+_EXT_ALIAS = {".jpeg": ".jpg", ".jpe": ".jpg"}   # 同內容不同副檔名寫法 → 同一個檔
+
+# block JSON 內的圖片參照：files[].path_to_save = "temp/..."、tiptap image src = "http://host/uploads/temp/..."
+_KEY_RE = re.compile(r"(?:uploads/)?(temp/[\w\-./]+\.\w+)")
+_LINK_COLUMNS = ("content_id", "header_json", "content_json", "table_text", "table_json", "files")
+
+
+def cas_path(digest, ext):
+    return os.path.join(CAS_DIR, digest[:2], digest + ext)
+
+
+def storage_key(abs_path):
+    """絕對路徑 → rms_assets.storage_key（uploads/...）。"""
+    return "uploads/" + os.path.relpath(abs_path, UPLOAD_ROOT_DIR).replace(os.sep, "/")
+
+
+def key_path(key):
+    """rms_assets.storage_key → 絕對路徑。"""
+    return os.path.join(os.path.dirname(UPLOAD_ROOT_DIR), *key.split("/"))
+
+
+def store_stream(stream, ext):
+    """
+    邊讀邊算 SHA-256 寫進暫存檔，算完再 rename 到 CAS 路徑。
+    回傳 (abs_path, digest, size, created)；內容已存在 → created=False（只刷新 mtime，GC 寬限期重算）。
+    """
+    ext = _EXT_ALIAS.get(ext.lower(), ext.lower())
+    os.makedirs(CAS_DIR, exist_ok=True)
+    fd, tmp = tempfile.mkstemp(dir=CAS_DIR, suffix=".part")
+    h = hashlib.sha256()
+    size = 0
+    try:
+        with os.fdopen(fd, "wb") as out:
+            while True:
+                chunk = stream.read(_CHUNK)
+                if not chunk:
+                    break
+                h.update(chunk)
+                out.write(chunk)
+                size += len(chunk)
+        digest = h.hexdigest()
+        path = cas_path(digest, ext)
+        if os.path.exists(path):
+            os.utime(path)
+            return path, digest, size, False
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        os.replace(tmp, path)
+        return path, digest, size, True
+    finally:
+        if os.path.exists(tmp):
+            os.remove(tmp)
+
+
+def file_digest(path):
+    h = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(_CHUNK), b""):
+            h.update(chunk)
+    return h.hexdigest()
+
+
+def record_asset(cur, abs_path, mime_type, digest, size=None, token=None):
+    """
+    登記一個 CAS 檔到 rms_assets（以 content_hash 去重），有 token 就先掛在文件上。
+    回傳 (asset_id, storage_key, inserted)；同內容已登記過 → 沿用原本的 asset / storage_key。
+    """
+    key = storage_key(abs_path)
+    cur.execute("SELECT asset_id, storage_key FROM rms_assets WHERE content_hash=%s", (digest,))
+    row = cur.fetchone()
+    inserted = False
+    if row is None:
+        new_id = str(uuid.uuid4())
+        cur.execute("""
+          INSERT IGNORE INTO rms_assets (asset_id, storage_key, mime_type, byte_size, content_hash, created_at)
+          VALUES (%s,%s,%s,%s,%s,NOW())
+        """, (new_id, key, mime_type, os.path.getsize(abs_path) if size is None else size, digest))
+        if cur.rowcount == 1:
+            row, inserted = (new_id, key), True
+        else:
+            # 同時有人傳同一個檔，對方先寫進去了
+            cur.execute("SELECT asset_id, storage_key FROM rms_assets WHERE content_hash=%s", (digest,))
+            row = cur.fetchone()
+    asset_id, stored_key = (row["asset_id"], row["storage_key"]) if isinstance(row, dict) else row
+    if token:
+        # 上傳當下先掛在文件上（content_id 未知），存檔時 sync_asset_links 會換成實際的 block
+        cur.execute("""
+          INSERT INTO rms_asset_links (asset_id, document_token, content_id, created_at)
+          SELECT %s, %s, NULL, NOW() FROM DUAL
+          WHERE NOT EXISTS (SELECT 1 FROM rms_asset_links WHERE asset_id=%s AND document_token=%s)
+        """, (asset_id, token, asset_id, token))
+    return asset_id, stored_key, inserted
+
+
+# ==========================================================
+# 參照（rms_asset_links）
+# ==========================================================
+def extract_storage_keys(*texts):
+    """從 block 的 JSON 欄位（字串或 dict/list）撈出所有 uploads/temp/... 參照。"""
+    keys = set()
+    for t in texts:
+        if not t:
+            continue
+        if not isinstance(t, str):
+            t = str(t)
+        keys.update("uploads/" + m for m in _KEY_RE.findall(t))
+    return keys
+
+
+def _asset_ids(cur, keys):
+    if not keys:
+        return {}
+    keys = list(keys)
+    cur.execute(
+        f"SELECT asset_id, storage_key FROM rms_assets WHERE storage_key IN ({', '.join(['%s'] * len(keys))})",
+        keys,
+    )
+    out = {}
+    for r in cur.fetchall():
+        asset_id, key = (r["asset_id"], r["storage_key"]) if isinstance(r, dict) else r
+        out[key] = asset_id
+    return out
+
+
+def sync_asset_links(cur, token):
+    """依目前 rms_block_content 重建 token 的草稿連結（快照連結不動），回傳連結數。"""
+    cur.execute(f"SELECT {', '.join(_LINK_COLUMNS)} FROM rms_block_content WHERE document_token=%s", (token,))
+    refs = set()
+    for r in cur.fetchall():
+        r = r if isinstance(r, dict) else dict(zip(_LINK_COLUMNS, r))
+        for key in extract_storage_keys(*(r.get(c) for c in _LINK_COLUMNS[1:])):
+            refs.add((key, r["content_id"]))
+
+    cur.execute("DELETE FROM rms_asset_links WHERE document_token=%s AND snapshot_id IS NULL", (token,))
+    ids = _asset_ids(cur, {k for k, _ in refs})
+    rows = [(ids[k], token, cid) for k, cid in refs if k in ids]
+    if rows:
+        cur.executemany(
+            "INSERT INTO rms_asset_links (asset_id, document_token, content_id, created_at) VALUES (%s,%s,%s,NOW())",
+            rows,
+        )
+    return len(rows)
+
+
+def link_snapshot_assets(cur, snapshot_id, *texts):
+    """快照（不可變）用到的 asset 各記一筆連結，快照存在就不會被 GC。"""
+    ids = _asset_ids(cur, extract_storage_keys(*texts))
+    if ids:
+        cur.executemany(
+            "INSERT INTO rms_asset_links (asset_id, snapshot_id, created_at) VALUES (%s,%s,NOW())",
+            [(asset_id, snapshot_id) for asset_id in set(ids.values())],
+        )
+    return len(ids)
+
+
+# ==========================================================
+# GC
+# ==========================================================
+def _recently_touched(path, grace):
+    try:
+        return time.time() - os.stat(path).st_mtime < grace
+    except FileNotFoundError:
+        return False
+
+
+def collect_garbage(grace_seconds=None, dry_run=False, limit=500):
+    """
+    刪掉沒有任何連結、且建立 / 最後重傳都超過寬限期的 CAS asset。
+    先刪 DB row（條件式 DELETE，期間有人連上就不會刪），再刪檔；檔案 mtime 在寬限期內（剛被重傳）則保留檔案。
+    """
+    grace = ASSET_GC_GRACE_SECONDS if grace_seconds is None else int(grace_seconds)
+    stats = {"candidates": 0, "deleted": 0, "bytes": 0, "kept_recent": 0, "dry_run": bool(dry_run)}
+
+    with db(dict_cursor=True, scoped=False) as (conn, cur):
+        cur.execute("""
+          SELECT a.asset_id, a.storage_key, a.byte_size
+          FROM rms_assets AS a
+          WHERE a.content_hash IS NOT NULL
+            AND a.created_at < NOW() - INTERVAL %s SECOND
+            AND NOT EXISTS (SELECT 1 FROM rms_asset_links AS l WHERE l.asset_id = a.asset_id)
+          LIMIT %s
+        """, (grace, int(limit)))
+        candidates = cur.fetchall() or []
+        stats["candidates"] = len(candidates)
+
+        for a in candidates:
+            path = key_path(a["storage_key"])
+            if _recently_touched(path, grace):
+                stats["kept_recent"] += 1
+                continue
+            if dry_run:
+                stats["deleted"] += 1
+                stats["bytes"] += a["byte_size"] or 0
+                continue
+            cur.execute("""
+              DELETE FROM rms_assets
+              WHERE asset_id=%s AND NOT EXISTS (SELECT 1 FROM rms_asset_links WHERE asset_id=%s)
+            """, (a["asset_id"], a["asset_id"]))
+            if cur.rowcount != 1:
+                continue
+            conn.commit()   # 每刪一筆就 commit，刪檔失敗也不會卡住整批
+            stats["deleted"] += 1
+            for p in (path, normalized_path(path)):
+                if _recently_touched(p, grace):
+                    continue
+                try:
+                    stats["bytes"] += os.path.getsize(p)
+                    os.remove(p)
+                except FileNotFoundError:
+                    pass
+                except OSError as e:
+                    print(f"[asset_gc] remove {p} failed: {e}")
+    return stats
@@ -31,13 +31,120 @@ DB = {
     "charset": "utf8mb4",
 }
 
+# MySQL 連線池（db.py）：ping_after / max_lifetime / wait_timeout 單位皆為秒
+DB_POOL = {
+    "min": int(os.getenv("DB_POOL_MIN", "2")),
+    "max": int(os.getenv("DB_POOL_MAX", "10")),
+    "ping_after": float(os.getenv("DB_POOL_PING_AFTER", "30")),
+    "max_lifetime": float(os.getenv("DB_POOL_MAX_LIFETIME", "1800")),
+    "wait_timeout": float(os.getenv("DB_POOL_WAIT_TIMEOUT", "10")),
+}
+# 同一個 request 內的 db() 共用一條連線 / 一個交易（request 結束才 commit）；設 0 退回每個 db() 各自交易
+DB_REQUEST_SCOPE = os.getenv("DB_REQUEST_SCOPE", "1") not in ("0", "false", "False", "")
+
+# Oracle pool：啟動時預先建立各 alias 的 pool（大小 / getmode 等見 oracle_db.pool_config）
+ORACLE_POOL_WARMUP = os.getenv("ORACLE_POOL_WARMUP", "1") not in ("0", "false", "False", "")
+
+# 簽核人員（confirmer / approver）快取：ttl 秒、最多 max_entries 筆（LRU）；prefetch=1 時背景每 prefetch_interval 秒整批預載
+PERSONNEL_CACHE = {
+    "ttl": int(os.getenv("PERSONNEL_CACHE_TTL", "600")),
+    "max_entries": max(1, int(os.getenv("PERSONNEL_CACHE_MAX", "5000"))),
+    "prefetch": os.getenv("PERSONNEL_PREFETCH", "0") not in ("0", "false", "False", ""),
+    "prefetch_interval": int(os.getenv("PERSONNEL_PREFETCH_INTERVAL", "1800")),
+}
+
+# 可視範圍課別索引（modules/department.py）：超過幾秒視為過期、背景重建
+DEPT_INDEX_TTL = int(os.getenv("DEPT_INDEX_TTL", "900"))
+
+# Word 文件保護（限制編輯 forms）：password 空白 → 各渲染器用內建預設密碼；
+# spin_count = OOXML SHA-512 迭代次數；rotate_seconds > 0 時每隔幾秒換一組 salt/hash（0 = 行程內固定一組）
+DOCX_PROTECTION = {
+    "password": os.getenv("DOCX_PROTECTION_PASSWORD", ""),
+    "spin_count": int(os.getenv("DOCX_PROTECTION_SPIN_COUNT", "100000")),
+    "rotate_seconds": int(os.getenv("DOCX_PROTECTION_ROTATE_SECONDS", "0")),
+}
+
+# Word 內文圖片快取（docx_cache.load_image，每個渲染行程各一份）：原始 bytes 總量上限（MB）
+DOCX_IMAGE_CACHE_MB = int(os.getenv("DOCX_IMAGE_CACHE_MB", "256"))
+
+# Word 渲染 worker（render_worker.py）：workers = 子行程數（0 → 不開子行程，在 request thread 內直接渲染）；
+# queue_max = 排隊 + 執行中上限（滿了回 503）；timeout = 同步路由最多等幾秒；job_ttl = 非同步 job 結果保留秒數
+RENDER = {
+    "workers": int(os.getenv("RENDER_WORKERS", "2")),
+    "queue_max": int(os.getenv("RENDER_QUEUE_MAX", "16")),
+    "timeout": int(os.getenv("RENDER_TIMEOUT", "180")),
+    "job_ttl": int(os.getenv("RENDER_JOB_TTL", "900")),
+    "mp_context": os.getenv("RENDER_MP_CONTEXT", "spawn"),
+}
+
+# 渲染結果快取（render_cache.py）：快照預覽 / 草稿檢視同 payload 直接回上次的 Word；max_mb 為磁碟上限
+RENDER_CACHE = {
+    "enabled": os.getenv("RENDER_CACHE_ENABLED", "1") not in ("0", "false", "False", ""),
+    "dir": os.getenv("RENDER_CACHE_DIR", os.path.join("docxTemp", "_cache")),
+    "max_mb": int(os.getenv("RENDER_CACHE_MAX_MB", "512")),
+}
+
+# sync_eip 增量同步（sync_state.py / rms_sync_state）：只讀 watermark - lookback_hours 之後有新增 / 送審的文件；
+# 每 full_interval 秒跑一次全量對帳（補送審很久才簽核的文件）；已簽核文件寫回每 chunk_size 份一個交易
+SYNC_EIP = {
+    "lookback_hours": int(os.getenv("SYNC_EIP_LOOKBACK_HOURS", "168")),
+    "full_interval": int(os.getenv("SYNC_EIP_FULL_INTERVAL", str(6 * 3600))),
+    "chunk_size": int(os.getenv("SYNC_EIP_CHUNK_SIZE", "20")),   # 已簽核文件每幾份一個交易
+}
+
+# 同步排程器（sync_scheduler.py）：interval 秒 ±jitter 比例跑一輪；失敗 → backoff_base × 2^(連續失敗-1)，上限 backoff_max；
+# poll = 檢查 leader lease / 手動觸發的間隔；embedded=1 → python __main__.py 時順便在子行程跑排程器（開發用，正式環境請單獨跑 python sync_scheduler.py）
+SYNC_SCHEDULER = {
+    "interval": int(os.getenv("SYNC_INTERVAL", "1200")),
+    "jitter": float(os.getenv("SYNC_JITTER", "0.1")),
+    "backoff_base": int(os.getenv("SYNC_BACKOFF_BASE", "60")),
+    "backoff_max": int(os.getenv("SYNC_BACKOFF_MAX", "3600")),
+    "poll": int(os.getenv("SYNC_POLL", "15")),
+    "embedded": os.getenv("SYNC_SCHEDULER_EMBEDDED", "1") not in ("0", "false", "False", ""),
+}
+
+# 快照 payload 格式（modules/snapshot_codec.py）：auto（有裝 zstandard 用 zstd，否則 zlib）| zstd | zlib | json（舊格式，各欄一份 JSON）
+# 只影響新寫入的快照；讀取兩種格式都認得
+SNAPSHOT_CODEC = os.getenv("SNAPSHOT_CODEC", "auto").strip().lower()
+# 區塊去重：區塊內容以 sha256 存進 rms_block_payloads 一次，快照只記結構欄 + hash（SNAPSHOT_CODEC=json 時不適用）
+SNAPSHOT_BLOCK_DEDUP = os.getenv("SNAPSHOT_BLOCK_DEDUP", "1") not in ("0", "false", "False", "")
+
 # uploads
 DRAWIO_CLI_PATH = os.getenv("DRAWIO_CLI_PATH", r"..\drawio-windows\draw.io.exe") if platform.system() == "Windows" else os.getenv("DRAWIO_CLI_PATH", "drawio") 
+# draw.io 轉檔（drawio_service.py）：converter = cli | stub（不呼叫 draw.io，輸出 1x1 PNG，本機測試用）；
+# workers = 同時轉檔數；queue_max = 排隊 + 執行中上限；timeout = 單次轉檔秒數；
+# xvfb=1（Linux）→ 共用常駐 Xvfb（display），不再每次 xvfb-run
+DRAWIO = {
+    "converter": os.getenv("DRAWIO_CONVERTER", "cli"),
+    "workers": int(os.getenv("DRAWIO_WORKERS", "2")),
+    "queue_max": int(os.getenv("DRAWIO_QUEUE_MAX", "16")),
+    "timeout": int(os.getenv("DRAWIO_TIMEOUT", "120")),
+    "job_ttl": int(os.getenv("DRAWIO_JOB_TTL", "900")),
+    "xvfb": os.getenv("DRAWIO_XVFB", "1") not in ("0", "false", "False", ""),
+    "display": os.getenv("DRAWIO_DISPLAY", ":99"),
+}
 UPLOAD_FOLDER_NAME = "uploads"
 BASE_DIR = os.getcwd()
 UPLOAD_ROOT_DIR = os.path.join(BASE_DIR, UPLOAD_FOLDER_NAME)
 TEMP_ROOT_DIR = os.path.join(UPLOAD_ROOT_DIR, "temp")
 ALLOWED_EXTS = {"png","jpg","jpeg","gif","webp","bmp","svg"}
+# /uploads 送檔：mode 空白 → Flask 自己送；x-accel（nginx，需設 internal location 對應 accel_prefix）/ x-sendfile（Apache / lighttpd）→ 交給前端 proxy
+UPLOAD_SENDFILE = {
+    "mode": os.getenv("UPLOAD_SENDFILE_MODE", "").strip().lower(),
+    "accel_prefix": os.getenv("UPLOAD_ACCEL_PREFIX", "/_protected_uploads/"),
+}
+
+# 上傳檔 content-addressed 儲存（asset_store.py）：沒有任何文件 / 快照參照、且超過寬限秒數的 CAS 檔才會被 GC
+ASSET_GC_GRACE_SECONDS = int(os.getenv("ASSET_GC_GRACE_SECONDS", str(7 * 24 * 3600)))
+
+# 上傳圖片正規化（image_normalize.py）：另存 *.norm.<ext> 衍生檔給 Word 渲染用；
+# 寬度上限 = max_width_cm（A4 扣邊界約 17 cm）× max(dpi, 圖檔自帶 DPI)；quality 給 JPEG / WEBP
+IMAGE_NORMALIZE = {
+    "enabled": os.getenv("IMAGE_NORMALIZE_ENABLED", "1") not in ("0", "false", "False", ""),
+    "max_width_cm": float(os.getenv("IMAGE_NORMALIZE_MAX_WIDTH_CM", "17")),
+    "dpi": int(os.getenv("IMAGE_NORMALIZE_DPI", "150")),
+    "quality": int(os.getenv("IMAGE_NORMALIZE_QUALITY", "85")),
+}
 
 # step types (backend meaning)
 STEP = {
@@ -1,7 +1,18 @@
+import os
+import time
+import threading
+from collections import deque
+
 import MySQLdb
 import MySQLdb.cursors  # <-- add this line
 from contextlib import contextmanager
-from config import DB
+from flask import g, has_request_context, jsonify, got_request_exception
+from config import DB, DB_POOL, DB_REQUEST_SCOPE
+
+
+class PoolTimeout(RuntimeError):
+    """連線池借不到連線（等待超過 DB_POOL_WAIT_TIMEOUT）。"""
+
 
 def _connect(dict_cursor=False):
     kwargs = {
@@ -12,17 +23,447 @@ def _connect(dict_cursor=False):
         kwargs["cursorclass"] = MySQLdb.cursors.DictCursor
     return MySQLdb.connect(**kwargs)
 
+
+class _PooledConn:
+    __slots__ = ("conn", "created_at", "last_used")
+
+    def __init__(self, conn):
+        now = time.monotonic()
+        self.conn = conn
+        self.created_at = now
+        self.last_used = now
+
+
+class MySQLPool:
+    """有上限、thread-safe 的 MySQL 連線池。
+    - 借出時若閒置超過 ping_after 秒才 ping（避免每次借都多一趟 round trip）
+    - 存活超過 max_lifetime 秒的連線直接換新（避開 server 端 wait_timeout / 負載平衡器切線）
+    - 滿載時最多等 wait_timeout 秒，逾時丟 PoolTimeout
+    連線一律用預設 cursor 建立，dict cursor 由 db() 借出時再指定。"""
+
+    def __init__(self, cfg):
+        self.min_size = max(0, int(cfg["min"]))
+        self.max_size = max(1, int(cfg["max"]))
+        self.ping_after = float(cfg["ping_after"])
+        self.max_lifetime = float(cfg["max_lifetime"])
+        self.wait_timeout = float(cfg["wait_timeout"])
+
+        self._cond = threading.Condition()
+        self._idle = deque()
+        self._size = 0                       # 目前開著的連線數（idle + 借出）
+        self._pid = os.getpid()
+        self._warmed = False
+        self._stats = {
+            "borrowed": 0, "waited": 0, "wait_total_ms": 0.0, "wait_max_ms": 0.0,
+            "timeouts": 0, "created": 0, "recycled": 0, "ping_failed": 0, "discarded": 0,
+        }
+
+    # ---- internal ----
+    def _open(self):
+        item = _PooledConn(_connect())
+        with self._cond:
+            self._stats["created"] += 1
+        return item
+
+    @staticmethod
+    def _close_quietly(item):
+        try: item.conn.close()
+        except Exception: pass
+
+    def _warmup(self):
+        """第一次借用時補到 min_size（失敗不擋請求，之後照常按需建立）。"""
+        with self._cond:
+            if self._warmed:
+                return
+            self._warmed = True
+            need = max(0, min(self.min_size, self.max_size) - self._size)
+            self._size += need
+        for _ in range(need):
+            try:
+                item = self._open()
+            except Exception as e:
+                print(f"[db pool] warmup connect failed: {e}")
+                with self._cond:
+                    self._size -= 1
+                    self._cond.notify()
+                continue
+            with self._cond:
+                self._idle.append(item)
+                self._cond.notify()
+
+    def _validate(self, item):
+        """借出前檢查：超齡換新、閒置過久 ping；回傳可用的 item（可能是新的）。"""
+        now = time.monotonic()
+        if self.max_lifetime > 0 and now - item.created_at > self.max_lifetime:
+            self._close_quietly(item)
+            with self._cond:
+                self._stats["recycled"] += 1
+            return self._open()
+        if now - item.last_used > self.ping_after:
+            try:
+                item.conn.ping()
+            except Exception:
+                self._close_quietly(item)
+                with self._cond:
+                    self._stats["ping_failed"] += 1
+                return self._open()
+        return item
+
+    # ---- public ----
+    def acquire(self):
+        if not self._warmed:
+            self._warmup()
+
+        start = time.monotonic()
+        item, waited = None, False
+        with self._cond:
+            while True:
+                if self._idle:
+                    item = self._idle.pop()          # LIFO：優先拿最近用過的熱連線
+                    break
+                if self._size < self.max_size:
+                    self._size += 1                  # 先佔名額，鎖外再建立連線
+                    break
+                remaining = self.wait_timeout - (time.monotonic() - start)
+                if remaining <= 0:
+                    self._stats["timeouts"] += 1
+                    raise PoolTimeout(f"MySQL pool exhausted (max={self.max_size}, waited {self.wait_timeout}s)")
+                waited = True
+                self._cond.wait(remaining)
+
+            wait_ms = (time.monotonic() - start) * 1000
+            self._stats["borrowed"] += 1
+            if waited:
+                self._stats["waited"] += 1
+            self._stats["wait_total_ms"] += wait_ms
+            self._stats["wait_max_ms"] = max(self._stats["wait_max_ms"], wait_ms)
+
+        try:
+            return self._open() if item is None else self._validate(item)
+        except Exception:
+            with self._cond:
+                self._size -= 1
+                self._cond.notify()
+            raise
+
+    def release(self, item, broken=False):
+        if broken:
+            self._close_quietly(item)
+            with self._cond:
+                self._size -= 1
+                self._stats["discarded"] += 1
+                self._cond.notify()
+            return
+        item.last_used = time.monotonic()
+        with self._cond:
+            self._idle.append(item)
+            self._cond.notify()
+
+    def stats(self):
+        with self._cond:
+            s = dict(self._stats)
+            s.update({
+                "open": self._size,
+                "idle": len(self._idle),
+                "busy": self._size - len(self._idle),
+                "min": self.min_size,
+                "max": self.max_size,
+            })
+        s["wait_avg_ms"] = round(s["wait_total_ms"] / s["borrowed"], 3) if s["borrowed"] else 0.0
+        s["wait_total_ms"] = round(s["wait_total_ms"], 3)
+        s["wait_max_ms"] = round(s["wait_max_ms"], 3)
+        return s
+
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def get_pool():
+    """取得（必要時建立）本行程的連線池；fork 出來的子行程（sync_scheduler）會自建一個，不共用 socket。"""
+    global _pool
+    pid = os.getpid()
+    if _pool is None or _pool._pid != pid:
+        with _pool_lock:
+            if _pool is None or _pool._pid != pid:
+                _pool = MySQLPool(DB_POOL)
+    return _pool
+
+
+def pool_stats():
+    return get_pool().stats()
+
+
+# ==========================================================
+# 請求範圍連線：同一個 Flask request 內所有 db() 共用 flask.g 上的一條連線
+# ==========================================================
+_G_KEY = "_rms_db_scope"
+
+
+class _RequestScope:
+    __slots__ = ("item", "depth", "used", "seq", "broken", "finished", "failed")
+
+    def __init__(self, item):
+        self.item = item
+        self.depth = 0          # 目前巢狀的 db() 層數
+        self.used = False       # 這個交易裡已有成功結束的 db() 區塊
+        self.seq = 0            # savepoint 流水號
+        self.broken = False
+        self.finished = False   # after_request 已 commit / rollback
+        self.failed = False     # view 丟出未處理例外（got_request_exception）
+
+
+class _ScopedConn:
+    """包住共用連線：commit() 延後到請求結束（after_request）統一做；
+    rollback() 只退回本區塊的 savepoint，不影響同請求前面已成功的區塊。"""
+
+    def __init__(self, conn, rollback):
+        self._conn = conn
+        self._rollback = rollback
+
+    def commit(self):
+        pass
+
+    def rollback(self):
+        self._rollback()
+
+    def __getattr__(self, name):
+        return getattr(self._conn, name)
+
+
+def _request_scope():
+    if not DB_REQUEST_SCOPE or not has_request_context():
+        return None
+    scope = g.get(_G_KEY)
+    if scope is None:
+        scope = _RequestScope(get_pool().acquire())
+        setattr(g, _G_KEY, scope)
+    return scope
+
+
 @contextmanager
-def db(dict_cursor=False):
-    conn = _connect(dict_cursor=dict_cursor)
-    cur = conn.cursor()
+def _pooled_tx(dict_cursor):
+    pool = get_pool()
+    item = pool.acquire()
+    conn = item.conn
+    cur = conn.cursor(MySQLdb.cursors.DictCursor) if dict_cursor else conn.cursor()
+    broken = False
     try:
         yield conn, cur
         conn.commit()
     except Exception:
-        conn.rollback()
+        try:
+            conn.rollback()
+        except Exception:
+            broken = True                    # 連線已壞（斷線 / server 重啟）→ 不放回池
+        raise
+    finally:
+        try: cur.close()
+        except: pass
+        pool.release(item, broken=broken)
+
+
+@contextmanager
+def _scoped_tx(scope, dict_cursor):
+    conn = scope.item.conn
+    cur = conn.cursor(MySQLdb.cursors.DictCursor) if dict_cursor else conn.cursor()
+
+    # 交易一開頭、外層第一個區塊不需要 savepoint（失敗直接整筆 rollback 即可）；
+    # 其餘（巢狀、或前面已有成功區塊）都包 savepoint，失敗只退回自己這段
+    sp = None
+    if scope.depth > 0 or scope.used:
+        scope.seq += 1
+        sp = f"rms_sp_{scope.seq}"
+        cur.execute(f"SAVEPOINT {sp}")
+
+    def _rollback():
+        if sp:
+            cur.execute(f"ROLLBACK TO SAVEPOINT {sp}")
+        else:
+            conn.rollback()
+
+    scope.depth += 1
+    try:
+        yield _ScopedConn(conn, _rollback), cur
+        if sp:
+            cur.execute(f"RELEASE SAVEPOINT {sp}")
+        scope.used = True
+    except Exception:
+        try:
+            _rollback()
+        except Exception:
+            scope.broken = True
         raise
     finally:
-        try: cur.close(); conn.close()
+        scope.depth -= 1
+        try: cur.close()
+        except: pass
+
+
+@contextmanager
+def db(dict_cursor=False, scoped=True):
+    """取得 (conn, cur)。
+    在 Flask request 內（且 DB_REQUEST_SCOPE 開啟）會共用同一條連線與交易，
+    整個 request 結束時才 commit；scoped=False 則固定借一條獨立連線、區塊結束即 commit。"""
+    scope = _request_scope() if scoped else None
+    tx = _scoped_tx(scope, dict_cursor) if scope is not None else _pooled_tx(dict_cursor)
+    with tx as pair:
+        yield pair
+
+
+@contextmanager
+def session_cursor():
+    """
+    只做 session 層級操作（GET_LOCK 這類，不碰交易）用的 cursor：
+    在 request 內 → 直接用 request 共用的那條連線（不多借一條）；不在 request 內 → 從池借一條，用完歸還。
+    """
+    scope = _request_scope()
+    if scope is not None:
+        cur = scope.item.conn.cursor()
+        try:
+            yield cur
+        finally:
+            try: cur.close()
+            except: pass
+        return
+    pool = get_pool()
+    item = pool.acquire()
+    cur = item.conn.cursor()
+    try:
+        yield cur
+    finally:
+        try: cur.close()
         except: pass
+        pool.release(item)
+
+
+def dedicated_connection():
+    """不進連線池的獨立連線（GET_LOCK 這類綁 session、要長時間持有的用途）；用完自行 close()。"""
+    return _connect()
+
+
+def server_cursor(conn, dict_cursor=True):
+    """server-side cursor（SSDictCursor / SSCursor）：結果邊讀邊從 server 拿，不一次載進記憶體。
+    讀完或 close() 之前，同一條連線不能再下別的查詢。"""
+    return conn.cursor(MySQLdb.cursors.SSDictCursor if dict_cursor else MySQLdb.cursors.SSCursor)
+
+
+def flush_request_scope():
+    """
+    立刻 commit 目前 request 的共用交易（不在 request 內 / 沒開 scope → 不做事）。
+    給「MySQL 要先落地才能碰外部系統」的流程用（例如先寫 Oracle.RMS_DCC2EIP 的快照），
+    之後 request 怎麼結束都不會把已 commit 的部分退回。只能在 db() 區塊外呼叫。
+    """
+    if not DB_REQUEST_SCOPE or not has_request_context():
+        return
+    scope = g.get(_G_KEY)
+    if scope is None or scope.finished:
+        return
+    if scope.depth > 0:
+        raise RuntimeError("flush_request_scope() called inside a db() block")
+    if scope.broken:
+        raise RuntimeError("request-scoped connection is broken")
+    scope.item.conn.commit()
+    scope.used = False      # 新交易從頭開始，下一個外層區塊不用 savepoint
+
+
+def _mark_request_failed(sender, exception, **extra):
+    """got_request_exception：PROPAGATE_EXCEPTIONS 關掉時（正式環境）未處理例外一樣會跑 after_request，先記下來。"""
+    scope = g.get(_G_KEY)
+    if scope is not None:
+        scope.failed = True
+
+
+def _commit_request_scope(response):
+    """
+    after_request：正常回應 → commit；commit 失敗改回 500，避免前端以為已存檔。
+    view 丟出未處理例外 / 回應是 5xx → 整筆 rollback（dev server 跟正式 WSGI 行為一致）。
+    """
+    scope = g.get(_G_KEY)
+    if scope is None or scope.finished:
+        return response
+    scope.finished = True
+    conn = scope.item.conn
+    if scope.failed or response.status_code >= 500:
+        try:
+            conn.rollback()
+        except Exception:
+            scope.broken = True
+        return response
+    try:
+        if scope.broken:
+            raise RuntimeError("request-scoped connection is broken")
+        conn.commit()
+    except Exception as e:
+        print(f"[db] request commit failed: {e}")
+        try:
+            conn.rollback()
+        except Exception:
+            scope.broken = True
+        response = jsonify({"success": False, "message": f"Database commit failed: {e}"})
+        response.status_code = 500
+    return response
+
+
+def _release_request_scope(exc=None):
+    """teardown_request：沒走到 after_request（PROPAGATE_EXCEPTIONS 開著時的未處理例外）就整筆 rollback，最後把連線還回池。"""
+    scope = g.pop(_G_KEY, None)
+    if scope is None:
+        return
+    if not scope.finished:
+        try:
+            scope.item.conn.rollback()
+        except Exception:
+            scope.broken = True
+    get_pool().release(scope.item, broken=scope.broken)
+
+
+def init_app(app):
+    app.after_request(_commit_request_scope)
+    app.teardown_request(_release_request_scope)
+    got_request_exception.connect(_mark_request_failed, app)
+
+
+# ==========================================================
+# 自我檢查：python db.py --check-scope
+# 正式環境設定（PROPAGATE_EXCEPTIONS 關閉）下，view 寫到一半丟例外 → 不可留下任何寫入
+# （借 rms_sync_state 寫一筆 __scope_check__，檢查完一律刪掉）
+# ==========================================================
+def _check_scope():
+    from flask import Flask
+
+    name = "__scope_check__"
+    app = Flask(__name__)
+    app.config["PROPAGATE_EXCEPTIONS"] = False
+    init_app(app)
+
+    @app.route("/write-then-raise")
+    def _write_then_raise():
+        with db() as (conn, cur):
+            cur.execute("INSERT INTO rms_sync_state (sync_name, updated_at) VALUES (%s, NOW())", (name,))
+        raise RuntimeError("boom")
+
+    @app.route("/write-then-500")
+    def _write_then_500():
+        with db() as (conn, cur):
+            cur.execute("INSERT INTO rms_sync_state (sync_name, updated_at) VALUES (%s, NOW())", (name,))
+        return jsonify({"success": False}), 500
+
+    try:
+        for path in ("/write-then-raise", "/write-then-500"):
+            status = app.test_client().get(path).status_code
+            with db(scoped=False) as (conn, cur):
+                cur.execute("SELECT COUNT(*) FROM rms_sync_state WHERE sync_name=%s", (name,))
+                left = cur.fetchone()[0]
+            print(f"{path}: HTTP {status}, rows left = {left}")
+            assert status == 500 and left == 0, f"{path} left writes behind"
+    finally:
+        with db(scoped=False) as (conn, cur):
+            cur.execute("DELETE FROM rms_sync_state WHERE sync_name=%s", (name,))
+    print("request scope check passed")
+
 
+if __name__ == "__main__":
+    import sys
+    if "--check-scope" in sys.argv:
+        _check_scope()
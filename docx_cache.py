@@ -0,0 +1,237 @@
+# docx_cache.py
+#
+# Word 範本快取：每個範本（docx-template/*.docx）只解析一次，
+# 之後每次渲染拿一份獨立的 deepcopy，不再每次 unzip + parse 整個 package。
+# 範本檔 mtime / size 變了就自動重讀（直接覆蓋 docx-template 下的檔案即可生效）。
+#
+# 另外快取文件保護（documentProtection）的 salt/hash：同一組密碼 + spin count
+# 每個行程只算一次 10 萬次 SHA-512（或每 rotate_seconds 秒換一組），不再每份文件重算。
+#
+# 以及內文圖片：本地檔以 path + mtime、data:image 以內容 sha256 為 key，
+# 快取原始 bytes + 像素寬高 / DPI，同一張圖不再每次渲染都重讀檔、重解 base64、重開 Pillow。
+
+import io
+import os
+import copy
+import base64
+import hashlib
+import threading
+import time
+from collections import OrderedDict
+
+from docx import Document
+
+from config import DOCX_IMAGE_CACHE_MB
+from image_normalize import normalized_path
+
+
+class _TemplateEntry:
+    __slots__ = ("stamp", "doc", "blob", "copyable")
+
+    def __init__(self, stamp, doc, blob):
+        self.stamp = stamp          # (mtime_ns, size)
+        self.doc = doc              # 已套 prepare 的母本，只讀不寫，僅供 deepcopy
+        self.blob = blob            # 母本存成 bytes（deepcopy 不可用時的後備來源）
+        self.copyable = True
+
+
+_templates = {}   # (abs path, prepare key) -> _TemplateEntry
+_lock = threading.Lock()
+_stats = {"hits": 0, "loads": 0, "copy_fallbacks": 0}
+
+
+def _stamp(path):
+    st = os.stat(path)
+    return st.st_mtime_ns, st.st_size
+
+
+def _prepare_key(prepare):
+    if prepare is None:
+        return None
+    return f"{getattr(prepare, '__module__', '')}.{getattr(prepare, '__qualname__', repr(prepare))}"
+
+
+def _load(path, prepare):
+    doc = Document(path)
+    if prepare is not None:
+        prepare(doc)
+    buf = io.BytesIO()
+    doc.save(buf)
+    return doc, buf.getvalue()
+
+
+def _clone(entry):
+    """deepcopy 母本（整個 package：parts / rels / XML 樹都複製，彼此不共用）；
+    第一次失敗就改走 bytes 重新解析（仍省掉讀檔與 prepare）。"""
+    if entry.copyable:
+        try:
+            doc = copy.deepcopy(entry.doc)
+            if doc.part.package is not entry.doc.part.package:
+                return doc
+        except Exception as e:
+            print(f"[docx_cache] deepcopy failed, fallback to bytes: {e}")
+        entry.copyable = False
+        with _lock:
+            _stats["copy_fallbacks"] += 1
+    return Document(io.BytesIO(entry.blob))
+
+
+def load_template(path, prepare=None):
+    """
+    取得範本的一份獨立 Document（可任意修改 / save，不影響快取）。
+    prepare(doc)：只在解析範本時跑一次的前置處理（例如 apply_default_fonts），結果一起快取。
+    """
+    abspath = os.path.abspath(path)
+    key = (abspath, _prepare_key(prepare))
+    stamp = _stamp(abspath)
+
+    entry = _templates.get(key)
+    if entry is None or entry.stamp != stamp:
+        with _lock:
+            entry = _templates.get(key)
+            if entry is None or entry.stamp != stamp:
+                doc, blob = _load(abspath, prepare)
+                entry = _TemplateEntry(stamp, doc, blob)
+                _templates[key] = entry
+                _stats["loads"] += 1
+            else:
+                _stats["hits"] += 1
+    else:
+        with _lock:
+            _stats["hits"] += 1
+    return _clone(entry)
+
+
+def warm_templates(paths, prepare=None):
+    """預先解析範本（啟動 / worker 初始化時呼叫）；不存在的檔案略過。"""
+    for path in paths:
+        try:
+            load_template(path, prepare)
+        except FileNotFoundError:
+            continue
+
+
+def clear_templates():
+    with _lock:
+        _templates.clear()
+
+
+def template_cache_stats():
+    with _lock:
+        s = dict(_stats)
+        s["templates"] = [os.path.basename(p) for p, _ in _templates]
+    return s
+
+
+# ==========================================================
+# 文件保護 salt / hash
+# ==========================================================
+_protection = {}   # (password, spin_count) -> (computed_at, salt_b64, hash_b64)
+_protection_lock = threading.Lock()
+
+
+def protection_hash(password, spin_count, compute, rotate_seconds=0):
+    """
+    回傳 (salt_b64, hash_b64)。compute(password, spin_count) 為實際的 OOXML 雜湊函式（各渲染器自帶）。
+    rotate_seconds <= 0：行程內永久沿用；> 0：超過秒數就重算一組新的 salt。
+    同時多個請求進來只有一個會真的去算，其餘等它算完直接拿。
+    """
+    key = (password, int(spin_count))
+    now = time.monotonic()
+    hit = _protection.get(key)
+    if hit is not None and (rotate_seconds <= 0 or now - hit[0] < rotate_seconds):
+        return hit[1], hit[2]
+    with _protection_lock:
+        hit = _protection.get(key)
+        if hit is None or (rotate_seconds > 0 and now - hit[0] >= rotate_seconds):
+            salt_b64, hash_b64 = compute(password, spin_count=int(spin_count))
+            hit = (time.monotonic(), salt_b64, hash_b64)
+            _protection[key] = hit
+    return hit[1], hit[2]
+
+
+# ==========================================================
+# 內文圖片（bytes + 尺寸）
+# ==========================================================
+class CachedImage:
+    __slots__ = ("blob", "width", "height", "dpi")
+
+    def __init__(self, blob, width, height, dpi):
+        self.blob = blob
+        self.width = width      # 像素；Pillow 讀不出來時為 None（呼叫端自行 fallback 寬度）
+        self.height = height
+        self.dpi = dpi          # (x, y)，圖檔沒寫 → (96, 96)
+
+    def stream(self):
+        """每次給一個新的 BytesIO（add_picture 會讀到尾，不能共用）。"""
+        return io.BytesIO(self.blob)
+
+
+_images = OrderedDict()    # key -> CachedImage（LRU）
+_images_bytes = 0
+_images_max = DOCX_IMAGE_CACHE_MB * 1024 * 1024
+_images_lock = threading.Lock()
+_image_stats = {"hits": 0, "misses": 0, "evicted": 0}
+
+
+def _probe(blob):
+    from PIL import Image
+    try:
+        with Image.open(io.BytesIO(blob)) as img:
+            return img.width, img.height, img.info.get("dpi", (96, 96))
+    except Exception:
+        return None, None, (96, 96)
+
+
+def load_image(src):
+    """
+    src：本地路徑（uploads/...，有 *.norm.* 衍生檔時改讀衍生檔）或 data:image/...;base64,... 字串。
+    回傳 CachedImage；本地檔不存在 → None。base64 壞掉照樣丟例外（跟直接 b64decode 一樣）。
+    """
+    global _images_bytes
+    if src.startswith("data:image"):
+        key = ("data", hashlib.sha256(src.encode("utf-8")).digest())
+        path = None
+    else:
+        # 上傳時有產正規化衍生檔（image_normalize）就優先用它，沒有才讀原檔
+        for path in (normalized_path(src), src):
+            try:
+                st = os.stat(path)
+                break
+            except OSError:
+                continue
+        else:
+            return None
+        key = ("file", os.path.abspath(path), st.st_mtime_ns, st.st_size)
+
+    with _images_lock:
+        hit = _images.get(key)
+        if hit is not None:
+            _images.move_to_end(key)
+            _image_stats["hits"] += 1
+            return hit
+
+    if path is None:
+        blob = base64.b64decode(src.split(",", 1)[-1])
+    else:
+        with open(path, "rb") as f:
+            blob = f.read()
+    img = CachedImage(blob, *_probe(blob))
+
+    with _images_lock:
+        _image_stats["misses"] += 1
+        if len(blob) <= _images_max and key not in _images:
+            _images[key] = img
+            _images_bytes += len(blob)
+            while _images_bytes > _images_max and _images:
+                _, old = _images.popitem(last=False)
+                _images_bytes -= len(old.blob)
+                _image_stats["evicted"] += 1
+    return img
+
+
+def image_cache_stats():
+    with _images_lock:
+        s = dict(_image_stats)
+        s.update({"entries": len(_images), "bytes": _images_bytes, "max_bytes": _images_max})
+    return s
@@ -0,0 +1,199 @@
+# drawio_service.py
+#
+# draw.io → PNG 轉檔服務：
+#   - 結果快取：.drawio 以內容 sha256 存進 CAS，PNG 放在旁邊（<sha256>.drawio.png），
+#     同一張圖重傳（內容沒變）直接回上次的 PNG，不再開 Electron
+#   - 有上限的轉檔池：DRAWIO_WORKERS 個 thread 各自呼叫 draw.io CLI（真正吃 CPU 的是子行程），
+#     外面包 JobQueue，排隊 + 執行中超過 DRAWIO_QUEUE_MAX 直接拒絕
+#   - Linux：共用一個常駐 Xvfb（DISPLAY=DRAWIO_DISPLAY），不再每次 xvfb-run 起一個 X server；
+#     找不到 Xvfb 才退回 xvfb-run
+#   - DRAWIO_CONVERTER=stub：不呼叫 draw.io，輸出 1x1 PNG（本機開發 / 測試用）
+# 同一份 .drawio 同時多個請求 → 依內容 hash 排隊，只有第一個真的轉，其餘等它做完直接命中。
+
+import os
+import uuid
+import shutil
+import platform
+import threading
+import subprocess
+from concurrent.futures import ThreadPoolExecutor
+
+from config import DRAWIO, DRAWIO_CLI_PATH
+from db import db
+from job_queue import JobQueue, QueueFull  # noqa: F401（QueueFull 給呼叫端 import）
+from asset_store import cas_path, store_stream, storage_key, file_digest, record_asset
+
+PNG_SUFFIX = ".drawio.png"
+DRAWIO_MIMETYPE = "application/vnd.jgraph.mxfile"
+
+# 1x1 透明 PNG（stub 轉檔輸出）
+_STUB_PNG = bytes.fromhex(
+    "89504e470d0a1a0a0000000d4948445200000001000000010806000000"
+    "1f15c4890000000d49444154789c6360000002000001e221bc330000000049454e44ae426082"
+)
+
+
+class ConvertError(RuntimeError):
+    """draw.io CLI 不存在 / 轉檔失敗 / 沒產出 PNG。"""
+
+
+# ==========================================================
+# 常駐 Xvfb
+# ==========================================================
+_xvfb = None
+_xvfb_lock = threading.Lock()
+
+
+def _display():
+    """回傳可用的 DISPLAY（必要時啟動 / 重啟 Xvfb）；沒有 Xvfb 可用 → None（改走 xvfb-run）。"""
+    global _xvfb
+    if not DRAWIO["xvfb"] or not shutil.which("Xvfb"):
+        return None
+    with _xvfb_lock:
+        if _xvfb is None or _xvfb.poll() is not None:
+            _xvfb = subprocess.Popen(
+                ["Xvfb", DRAWIO["display"], "-screen", "0", "1280x1024x24", "-nolisten", "tcp"],
+                stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+            )
+            print(f"[drawio] Xvfb started on {DRAWIO['display']} (pid={_xvfb.pid})")
+        return DRAWIO["display"]
+
+
+def shutdown():
+    global _xvfb
+    drawio_queue.shutdown()
+    with _xvfb_lock:
+        if _xvfb is not None and _xvfb.poll() is None:
+            _xvfb.terminate()
+        _xvfb = None
+
+
+# ==========================================================
+# 轉檔
+# ==========================================================
+def _run_cli(in_path, out_path):
+    args = [DRAWIO_CLI_PATH, "-x", in_path, "--format", "png", "--output", out_path]
+    env = None
+    if platform.system() == "Linux":
+        args.append("--no-sandbox")
+        display = _display()
+        if display:
+            env = dict(os.environ, DISPLAY=display)
+        else:
+            args = ["xvfb-run", "-a", *args]
+    try:
+        subprocess.run(args, check=True, capture_output=True, text=True, env=env, timeout=DRAWIO["timeout"])
+    except FileNotFoundError:
+        raise ConvertError("DRAWIO_CLI_PATH not found. Check config.DRAWIO_CLI_PATH")
+    except subprocess.CalledProcessError as e:
+        raise ConvertError(f"Draw.io convert failed: {e.stderr or e}")
+    except subprocess.TimeoutExpired:
+        raise ConvertError(f"Draw.io convert timed out after {DRAWIO['timeout']}s")
+
+
+def _convert(in_path, out_path):
+    """轉到暫存檔再 rename：快取命中判斷只看最終檔存不存在，不會拿到半成品。"""
+    tmp = f"{out_path}.{uuid.uuid4().hex}.part.png"
+    try:
+        if DRAWIO["converter"] == "stub":
+            with open(tmp, "wb") as f:
+                f.write(_STUB_PNG)
+        else:
+            _run_cli(in_path, tmp)
+        if not os.path.exists(tmp) or os.path.getsize(tmp) == 0:
+            raise ConvertError("Conversion produced no PNG")
+        os.replace(tmp, out_path)
+    finally:
+        if os.path.exists(tmp):
+            os.remove(tmp)
+
+
+def _result(in_path, digest, token, cached):
+    """PNG + .drawio 登記 rms_assets（以內容去重）並組回應（同原本 /uploads/drawio 的格式）。"""
+    png_path = cas_path(digest, PNG_SUFFIX)
+    png_key, src_key = storage_key(png_path), storage_key(in_path)
+    asset_id = None
+    try:
+        with db() as (conn, cur):   # 轉檔 thread 裡（沒有 request）自己借一條；快取命中走 request 的連線
+            asset_id, png_key, _ = record_asset(cur, png_path, "image/png", file_digest(png_path), token=token)
+            _, src_key, _ = record_asset(cur, in_path, DRAWIO_MIMETYPE, digest, token=token)
+    except Exception as e:
+        print(f"[drawio] asset record failed: {e}")
+
+    png_rel, src_rel = png_key.split("/", 1)[1], src_key.split("/", 1)[1]
+    payload = {
+        "success": True,
+        "url": f"/uploads/{png_rel}",
+        "path_to_save": png_rel,
+        "download_url": f"/uploads/download/{src_rel}",
+        "cached": cached,
+    }
+    if asset_id:
+        payload["asset_id"] = asset_id
+    return payload
+
+
+def _convert_job(in_path, digest, token):
+    png_path = cas_path(digest, PNG_SUFFIX)
+    with _locks_lock:
+        lock = _locks.setdefault(digest, threading.Lock())
+    with lock:
+        try:
+            cached = os.path.exists(png_path)
+            if not cached:
+                _convert(in_path, png_path)
+        finally:
+            with _locks_lock:
+                _locks.pop(digest, None)
+    return _result(in_path, digest, token, cached)
+
+
+drawio_queue = JobQueue(
+    "drawio",
+    lambda: ThreadPoolExecutor(max_workers=max(1, DRAWIO["workers"]), thread_name_prefix="drawio"),
+    max_pending=DRAWIO["queue_max"], ttl=DRAWIO["job_ttl"],
+)
+_locks = {}               # digest -> Lock：同一份 .drawio 同時只轉一次
+_locks_lock = threading.Lock()
+
+
+# ==========================================================
+# public
+# ==========================================================
+def save_drawio(stream):
+    """把上傳的 .drawio 存進 CAS，回傳 (abs_path, digest)。"""
+    in_path, digest, _, _ = store_stream(stream, ".drawio")
+    return in_path, digest
+
+
+def cached_result(in_path, digest, token=None):
+    """PNG 已經有了 → 直接回應 payload（不進佇列）；沒有 → None。"""
+    if os.path.exists(cas_path(digest, PNG_SUFFIX)):
+        return _result(in_path, digest, token, True)
+    return None
+
+
+def submit(in_path, digest, token=None):
+    """排入轉檔，回傳 job id（佇列滿丟 QueueFull）。"""
+    return drawio_queue.submit(_convert_job, in_path, digest, token, meta={"digest": digest})
+
+
+def convert(in_path, digest, token=None):
+    """同步：快取命中直接回；否則排入佇列並等它做完（失敗丟 ConvertError / TimeoutError）。"""
+    hit = cached_result(in_path, digest, token)
+    if hit is not None:
+        return hit
+    job_id = submit(in_path, digest, token)
+    try:
+        return drawio_queue.wait(job_id, timeout=DRAWIO["timeout"] + 30)
+    finally:
+        drawio_queue.discard(job_id)
+
+
+def status(job_id):
+    return drawio_queue.status(job_id)
+
+
+def result(job_id):
+    job = drawio_queue.get(job_id)
+    return job.future.result() if job is not None and job.future.done() else None
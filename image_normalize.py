@@ -0,0 +1,108 @@
+# image_normalize.py
+#
+# 上傳圖片正規化：手機原圖（8~20 MB）、超大 PNG 截圖原封不動塞進每份 Word 太浪費，
+# 上傳時另外產一份「衍生檔」放在原檔旁邊（abc.jpg → abc.norm.jpg）：
+#   - 依 EXIF 轉正方向，再把 EXIF / XMP 等中繼資料拿掉（ICC 色彩描述檔保留）
+#   - 寬度上限 = 可列印寬度（IMAGE_NORMALIZE_MAX_WIDTH_CM）× max(目標 DPI, 圖檔自帶 DPI)
+#     → 圖檔寫的 DPI 照抄，Word 裡算出來的物理寬度跟用原圖時一樣（只是像素少了）
+#   - 重新壓縮（JPEG / WEBP quality、PNG optimize）
+# 原檔照留（下載、前端編輯器用），渲染器透過 normalized_path() 優先讀衍生檔。
+# 沒縮、沒轉、也沒變小 → 不產衍生檔，渲染器自然退回原檔。
+
+import io
+import os
+
+from config import IMAGE_NORMALIZE
+
+NORM_TAG = ".norm"
+_FORMATS = {".jpg": "JPEG", ".jpeg": "JPEG", ".png": "PNG", ".webp": "WEBP"}   # gif（動圖）/ svg / bmp 不處理
+
+
+def normalized_path(path):
+    """原檔路徑 → 衍生檔路徑（不檢查是否存在）。"""
+    root, ext = os.path.splitext(path)
+    return f"{root}{NORM_TAG}{ext}"
+
+
+def is_normalized(path):
+    return os.path.splitext(os.path.splitext(path)[0])[1] == NORM_TAG
+
+
+def _max_width_px(dpi_x):
+    dpi = max(float(IMAGE_NORMALIZE["dpi"]), float(dpi_x or 0))
+    return int(round(IMAGE_NORMALIZE["max_width_cm"] / 2.54 * dpi))
+
+
+def normalize_bytes(blob, ext):
+    """
+    回傳 (衍生檔 bytes, info dict)；不需要 / 不支援 → (None, info)。
+    info：width / height（衍生檔像素）、resized、transposed、orig_bytes、bytes。
+    """
+    fmt = _FORMATS.get(ext.lower())
+    info = {"orig_bytes": len(blob), "resized": False, "transposed": False}
+    if fmt is None:
+        return None, info
+
+    from PIL import Image, ImageOps
+
+    with Image.open(io.BytesIO(blob)) as src:
+        dpi = src.info.get("dpi", (96, 96))
+        icc = src.info.get("icc_profile")
+        info["transposed"] = src.getexif().get(0x0112, 1) != 1   # 0x0112 = Orientation
+        img = ImageOps.exif_transpose(src)
+
+        max_w = _max_width_px(dpi[0])
+        if img.width > max_w:
+            h = max(1, round(img.height * max_w / img.width))
+            img = img.resize((max_w, h), Image.LANCZOS)
+            info["resized"] = True
+
+        opts = {"dpi": dpi}
+        if icc:
+            opts["icc_profile"] = icc
+        if fmt == "JPEG":
+            if img.mode not in ("RGB", "L", "CMYK"):
+                img = img.convert("RGB")
+            opts.update(quality=IMAGE_NORMALIZE["quality"], optimize=True, progressive=True)
+        elif fmt == "WEBP":
+            opts.update(quality=IMAGE_NORMALIZE["quality"], method=4)
+        else:
+            opts.update(optimize=True)
+
+        out = io.BytesIO()
+        img.save(out, format=fmt, **opts)   # 沒傳 exif= → 中繼資料不帶過去
+
+    data = out.getvalue()
+    info.update(width=img.width, height=img.height, bytes=len(data))
+    if not info["resized"] and not info["transposed"] and len(data) >= len(blob):
+        return None, info
+    return data, info
+
+
+def normalize_file(path):
+    """
+    對已存檔的上傳圖片產衍生檔；回傳 (衍生檔路徑, info)，不需要 → (None, info)。
+    先寫暫存檔再 rename，渲染器不會讀到寫一半的檔。
+    """
+    if not IMAGE_NORMALIZE["enabled"] or is_normalized(path):
+        return None, {}
+    with open(path, "rb") as f:
+        blob = f.read()
+    data, info = normalize_bytes(blob, os.path.splitext(path)[1])
+    if data is None:
+        return None, info
+    out = normalized_path(path)
+    tmp = out + ".part"
+    with open(tmp, "wb") as f:
+        f.write(data)
+    os.replace(tmp, out)
+    return out, info
+
+
+if __name__ == "__main__":
+    # python image_normalize.py uploads/temp/2025/10/19/abc.jpg ...：手動（或補跑舊檔）產衍生檔
+    import sys
+
+    for p in sys.argv[1:]:
+        out, info = normalize_file(p)
+        print(p, "->", out or "(skip)", info)
@@ -0,0 +1,152 @@
+# job_queue.py
+#
+# 通用「有上限的工作佇列 + job id 登記簿」：包住一個 concurrent.futures executor，
+# 提供 submit / status / result，排隊中 + 執行中的工作超過 max_pending 直接拒絕（QueueFull），
+# 完成的工作保留 ttl 秒供前端輪詢 / 下載，逾期清掉（可掛 on_expire 順便刪輸出檔）。
+
+import time
+import uuid
+import threading
+from concurrent.futures import TimeoutError as FutureTimeout
+from concurrent.futures.process import BrokenProcessPool
+
+
+class QueueFull(RuntimeError):
+    """佇列已滿（排隊 + 執行中的工作數達 max_pending）。"""
+
+
+class _Job:
+    __slots__ = ("id", "future", "meta", "created_at", "finished_at")
+
+    def __init__(self, job_id, future, meta):
+        self.id = job_id
+        self.future = future
+        self.meta = meta or {}
+        self.created_at = time.time()
+        self.finished_at = None
+
+    @property
+    def state(self):
+        f = self.future
+        if not f.done():
+            return "running" if f.running() else "queued"
+        return "failed" if f.cancelled() or f.exception() is not None else "done"
+
+
+class JobQueue:
+    def __init__(self, name, executor_factory, max_pending=16, ttl=900, on_expire=None):
+        self.name = name
+        self.max_pending = max(1, int(max_pending))
+        self.ttl = float(ttl)
+        self._factory = executor_factory
+        self._executor = None
+        self._on_expire = on_expire
+        self._jobs = {}
+        self._pending = 0
+        self._lock = threading.Lock()
+        self._stats = {"submitted": 0, "rejected": 0, "done": 0, "failed": 0, "restarts": 0}
+
+    # ---- internal ----
+    def _get_executor(self):
+        if self._executor is None:
+            self._executor = self._factory()
+        return self._executor
+
+    def _finished(self, job, fut):
+        with self._lock:
+            self._pending -= 1
+            job.finished_at = time.time()
+            ok = not fut.cancelled() and fut.exception() is None
+            self._stats["done" if ok else "failed"] += 1
+            # worker 掛掉 → 下一次 submit 重建 pool（只重置「目前這個」已壞的 pool，不誤殺新建的）
+            if self._executor is not None and getattr(self._executor, "_broken", False):
+                self._executor = None
+                self._stats["restarts"] += 1
+
+    def _purge(self):
+        now = time.time()
+        expired = []
+        with self._lock:
+            for jid, job in list(self._jobs.items()):
+                if job.finished_at is not None and now - job.finished_at > self.ttl:
+                    expired.append(self._jobs.pop(jid))
+        if self._on_expire:
+            for job in expired:
+                try:
+                    self._on_expire(job)
+                except Exception as e:
+                    print(f"[{self.name}] on_expire error: {e}")
+
+    # ---- public ----
+    def submit(self, fn, *args, meta=None, **kwargs):
+        """排入工作，回傳 job id；滿了丟 QueueFull。"""
+        self._purge()
+        with self._lock:
+            if self._pending >= self.max_pending:
+                self._stats["rejected"] += 1
+                raise QueueFull(f"{self.name} queue is full ({self.max_pending} pending)")
+            self._pending += 1
+            try:
+                try:
+                    fut = self._get_executor().submit(fn, *args, **kwargs)
+                except BrokenProcessPool:
+                    self._executor = None        # 已壞但還沒有 job 結束來觸發重建
+                    self._stats["restarts"] += 1
+                    fut = self._get_executor().submit(fn, *args, **kwargs)
+            except Exception:
+                self._pending -= 1
+                raise
+            job = _Job(uuid.uuid4().hex, fut, meta)
+            self._jobs[job.id] = job
+            self._stats["submitted"] += 1
+        fut.add_done_callback(lambda f, job=job: self._finished(job, f))
+        return job.id
+
+    def get(self, job_id):
+        self._purge()
+        with self._lock:
+            return self._jobs.get(job_id)
+
+    def status(self, job_id):
+        """回傳 job 狀態 dict；不存在（或已過期）→ None。"""
+        job = self.get(job_id)
+        if job is None:
+            return None
+        state = job.state
+        out = {
+            "job_id": job.id,
+            "status": state,
+            "created_at": job.created_at,
+            "finished_at": job.finished_at,
+            "meta": job.meta,
+        }
+        if state == "failed":
+            out["error"] = "cancelled" if job.future.cancelled() else str(job.future.exception())
+        return out
+
+    def wait(self, job_id, timeout=None):
+        """等工作結束並回傳結果（失敗會把 worker 的例外原樣丟出；逾時丟 TimeoutError）。"""
+        job = self.get(job_id)
+        if job is None:
+            raise KeyError(job_id)
+        try:
+            return job.future.result(timeout=timeout)
+        except FutureTimeout:
+            raise TimeoutError(f"{self.name} job {job_id} not finished in {timeout}s")
+
+    def discard(self, job_id):
+        """同步呼叫端拿到結果後自行清掉（不等 ttl）。"""
+        with self._lock:
+            self._jobs.pop(job_id, None)
+
+    def stats(self):
+        with self._lock:
+            s = dict(self._stats)
+            s.update({"pending": self._pending, "max_pending": self.max_pending, "jobs": len(self._jobs)})
+        return s
+
+    def shutdown(self):
+        with self._lock:
+            ex, self._executor = self._executor, None
+        if ex is not None:
+            ex.shutdown(wait=False, cancel_futures=True)
@@ -16,6 +16,8 @@
 #   §18 F6 converter 全函數 + 節點數對帳（對不上 raise，絕不靜默吞節點）
 
 import json
+import os
+from functools import lru_cache
 
 from utils import new_token
 
@@ -56,6 +58,24 @@ def chapter_for_step(step_type):
     return CHAPTER_BY_STEP[step_type]
 
 
+def _batched_ids(batch=256):
+    """new_token() 的批次版：一次 os.urandom 取 batch 個 uuid4 字串（格式同 str(uuid.uuid4())），
+    大文件攤平時省掉每節點一次 syscall + UUID 物件建立。回傳可呼叫的 id_factory。"""
+    pool = []
+
+    def next_id():
+        if not pool:
+            raw = bytearray(os.urandom(16 * batch))
+            for i in range(0, len(raw), 16):
+                raw[i + 6] = (raw[i + 6] & 0x0F) | 0x40   # version 4
+                raw[i + 8] = (raw[i + 8] & 0x3F) | 0x80   # RFC 4122 variant
+                h = raw[i:i + 16].hex()
+                pool.append(f"{h[:8]}-{h[8:12]}-{h[12:16]}-{h[16:20]}-{h[20:]}")
+        return pool.pop()
+
+    return next_id
+
+
 # ============================================================
 # 編號（§5 / §5.1 / §5.2）
 # ============================================================
@@ -101,30 +121,39 @@ def format_node_number(chapter, index_path):
       [..., i8]       → L8 → "({i..})"   小寫羅馬
 
     對應 §5.2 測試向量；超過 L8 → ValueError。
+    Word 匯出每個節點都會叫一次，結果只跟 (depth, 章節/自身 index) 有關 → 走 _node_label 快取。
     """
     depth = 1 + len(index_path)
     if depth == 2:
-        return f"{chapter}.{index_path[0]}"
+        return _node_label(2, chapter, index_path[0], None)
+    if depth == 3:
+        return _node_label(3, chapter, index_path[0], index_path[1])
+    return _node_label(depth, None, index_path[-1], None)
+
+
+@lru_cache(maxsize=4096)
+def _node_label(depth, chapter, first, second):
+    if depth == 2:
+        return f"{chapter}.{first}"
     if depth == 3:
-        return f"{chapter}.{index_path[0]}.{index_path[1]}"
-    last = index_path[-1]
+        return f"{chapter}.{first}.{second}"
     if depth == 4:
-        return f"({last})"
+        return f"({first})"
     if depth == 5:
-        return f"({_to_alpha(last)})"
+        return f"({_to_alpha(first)})"
     if depth == 6:
-        return f"({_to_alpha(last).lower()})"
+        return f"({_to_alpha(first).lower()})"
     if depth == 7:
-        return f"({_to_roman(last)})"
+        return f"({_to_roman(first)})"
     if depth == 8:
-        return f"({_to_roman(last).lower()})"
+        return f"({_to_roman(first).lower()})"
     raise ValueError(f"depth {depth} 超過上限 {MAX_DEPTH}")
 
 
 # ============================================================
 # 巢狀樹 ←→ relational row（§7）
 # ============================================================
-def flatten_tree(step_trees, document_token, id_factory=new_token):
+def flatten_tree(step_trees, document_token, id_factory=new_token, reuse_ids=None):
     """
     存檔用：前端巢狀樹 → DB row list（DFS 攤平）。
 
@@ -137,6 +166,8 @@ def flatten_tree(step_trees, document_token, id_factory=new_token):
 
     規則（§F5）：
       - content_id 由後端 id_factory 分配（replace 下每存重發）
+      - 增量存檔時傳 reuse_ids（該文件 DB 現有的 content_id 集合）：
+        node 自帶的 content_id 若在集合內就沿用（同一 id 出現兩次只有第一個沿用），其餘照發新 id
       - parent_id 填父節點剛分到的 content_id（L2 為 None）
       - sort_order = 同 parent 下陣列 index（1-based）
       - depth 走訪累加，超過 MAX_DEPTH → raise（§13）
@@ -147,37 +178,81 @@ def flatten_tree(step_trees, document_token, id_factory=new_token):
     """
     rows = []
     echo_map = {}
+    used_ids = set()
+    next_id = _batched_ids() if id_factory is new_token else id_factory
 
-    def walk(node, step_type, parent_id, depth, sort_order):
-        if depth > MAX_DEPTH:
-            raise ValueError(f"節點 depth {depth} 超過上限 {MAX_DEPTH}（step_type={step_type}）")
-        cid = id_factory()
-        client_id = node.get("client_id")
-        if client_id is not None:
-            echo_map[client_id] = cid
-
-        row = {k: node.get(k) for k in _PAYLOAD_KEYS}
-        row["content_type"] = int(node.get("content_type", CT_EMPTY) or CT_EMPTY)
-        row["content_id"] = cid
-        row["document_token"] = document_token
-        row["step_type"] = step_type
-        row["parent_id"] = parent_id
-        row["sort_order"] = sort_order
-        row["depth"] = depth
-        rows.append(row)
-
-        children = node.get("children") or []
-        for idx, child in enumerate(children, start=1):
-            walk(child, step_type, cid, depth + 1, idx)
-
+    # 顯式 stack 取代遞迴 closure：子節點反序推入 → pop 出來仍是 DFS 前序（父先於子、同層照陣列順序）
+    stack = []
     for step in step_trees:
         step_type = int(step["step_type"])
-        for idx, node in enumerate(step.get("children") or [], start=1):
-            walk(node, step_type, None, 2, idx)  # L2 起算
+        children = step.get("children") or []
+        stack.extend((children[i], None, 2, i + 1) for i in range(len(children) - 1, -1, -1))  # L2 起算
+
+        while stack:
+            node, parent_id, depth, sort_order = stack.pop()
+            if depth > MAX_DEPTH:
+                raise ValueError(f"節點 depth {depth} 超過上限 {MAX_DEPTH}（step_type={step_type}）")
+            cid = node.get("content_id") if reuse_ids else None
+            if cid is not None and cid in reuse_ids and cid not in used_ids:
+                used_ids.add(cid)
+            else:
+                cid = next_id()
+            client_id = node.get("client_id")
+            if client_id is not None:
+                echo_map[client_id] = cid
+
+            row = {k: node.get(k) for k in _PAYLOAD_KEYS}
+            row["content_type"] = int(node.get("content_type", CT_EMPTY) or CT_EMPTY)
+            row["content_id"] = cid
+            row["document_token"] = document_token
+            row["step_type"] = step_type
+            row["parent_id"] = parent_id
+            row["sort_order"] = sort_order
+            row["depth"] = depth
+            rows.append(row)
+
+            kids = node.get("children")
+            if kids:
+                child_depth = depth + 1
+                stack.extend((kids[i], cid, child_depth, i + 1) for i in range(len(kids) - 1, -1, -1))
 
     return rows, echo_map
 
 
+_COORD_KEYS = ("step_type", "parent_id", "sort_order", "depth")
+
+
+def diff_block_rows(old_rows, new_rows, payload_equal):
+    """
+    增量存檔用：DB 現有 rows vs flatten_tree(reuse_ids=...) 產出的 rows，以 content_id 對齊。
+
+    payload_equal(old, new) 判斷內容欄是否相同（json 欄位正規化由呼叫端處理，本模組不碰 DB 格式）。
+
+    回傳：(inserts, updates, deletes, moved)
+      inserts : 新 rows（DB 沒有的 content_id），保持 DFS 順序 → 父節點一定先於子節點
+      updates : 座標或內容有變的新 rows
+      deletes : 要刪的 content_id（新樹裡已不存在）
+      moved   : updates 中座標（step_type / parent_id / sort_order / depth）有變的 content_id
+    """
+    old_by_id = {r["content_id"]: r for r in old_rows}
+    inserts, updates, moved = [], [], []
+    kept = set()
+    for r in new_rows:
+        cid = r["content_id"]
+        old = old_by_id.get(cid)
+        if old is None:
+            inserts.append(r)
+            continue
+        kept.add(cid)
+        coord_changed = any(old.get(k) != r.get(k) for k in _COORD_KEYS)
+        if coord_changed:
+            moved.append(cid)
+        if coord_changed or not payload_equal(old, r):
+            updates.append(r)
+    deletes = [cid for cid in old_by_id if cid not in kept]
+    return inserts, updates, deletes, moved
+
+
 def build_tree(flat_rows):
     """
     載入用：DB relational row → 巢狀樹（§7.3）。
@@ -185,38 +260,71 @@ def build_tree(flat_rows):
 
     回傳：[ { "step_type": int, "children": [node, ...] }, ... ]，step_type 升冪。
     每個 node 帶 content_id + payload 欄 + children[]。
+
+    單趟走訪、無遞迴：SQL 已 ORDER BY step_type, sort_order，同一 parent 的子節點到達順序
+    本來就排好了，只有真的亂序的 sibling list 才 sort（stable，結果與「全部收集再排序」相同）。
+    sort_order 另放平行 dict，不塞進輸出 node 再 pop。
+    ⚠️ 速度跟舊版差不多（--bench 50k 節點兩邊都在雜訊範圍內）：成本幾乎都在「每個節點建一個輸出 dict」，
+       回傳格式就是 dict 樹，這步省不掉。試過 __slots__ / 平行 list 的中繼結構再轉 dict，只是多一趟，沒有比較快 → 不採用。
+       這版的好處是不遞迴（深樹不會撞 recursion limit）、不再對已排好的 sibling 重排。
     """
-    by_id = {}
+    nodes = {}       # content_id -> node
+    kids = {}        # content_id -> children list（子節點可能比父節點先到，先佔好同一個 list 物件）
+    sort_of = {}     # content_id -> sort_order
+    step_roots = {}  # step_type -> [root nodes]
+    unsorted = set()        # 需要排序的 parent content_id
+    unsorted_steps = set()  # root 需要排序的 step_type
+    orphans = False
+
     for r in flat_rows:
+        cid = r["content_id"]
         node = {k: r.get(k) for k in _PAYLOAD_KEYS}
-        node["content_id"] = r["content_id"]
-        node["children"] = []
-        node["_sort_order"] = r.get("sort_order") or 0
-        by_id[r["content_id"]] = node
+        node["content_id"] = cid
+        children = kids.get(cid)
+        if children is None:
+            children = kids[cid] = []
+        node["children"] = children
+        nodes[cid] = node
+        sort_order = sort_of[cid] = r.get("sort_order") or 0
 
-    step_roots = {}  # step_type -> [root nodes]
-    for r in flat_rows:
-        node = by_id[r["content_id"]]
         parent_id = r.get("parent_id")
-        if parent_id and parent_id in by_id:
-            by_id[parent_id]["children"].append(node)
+        if parent_id:
+            siblings = kids.get(parent_id)
+            if siblings is None:
+                siblings = kids[parent_id] = []
+            elif siblings and sort_order < sort_of[siblings[-1]["content_id"]]:
+                unsorted.add(parent_id)
+            siblings.append(node)
         else:
-            step_roots.setdefault(int(r["step_type"]), []).append(node)
-
-    def sort_children(node):
-        node["children"].sort(key=lambda n: n["_sort_order"])
-        for c in node["children"]:
-            sort_children(c)
-        node.pop("_sort_order", None)
-
-    out = []
-    for step_type in sorted(step_roots.keys()):
-        roots = step_roots[step_type]
-        roots.sort(key=lambda n: n["_sort_order"])
-        for root in roots:
-            sort_children(root)
-        out.append({"step_type": step_type, "children": roots})
-    return out
+            step_type = int(r["step_type"])
+            roots = step_roots.get(step_type)
+            if roots is None:
+                step_roots[step_type] = [node]
+            else:
+                if sort_order < sort_of[roots[-1]["content_id"]]:
+                    unsorted_steps.add(step_type)
+                roots.append(node)
+
+    # parent_id 指向不存在節點的孤兒 → 當 root（與舊行為一致）；罕見路徑，照列序重建受影響 step 的 root list
+    for parent_id in [p for p in kids if p not in nodes]:
+        del kids[parent_id]
+        unsorted.discard(parent_id)
+        orphans = True
+    if orphans:
+        step_roots = {}
+        for r in flat_rows:
+            parent_id = r.get("parent_id")
+            if not parent_id or parent_id not in nodes:
+                step_roots.setdefault(int(r["step_type"]), []).append(nodes[r["content_id"]])
+        unsorted_steps = set(step_roots)
+
+    key = lambda n: sort_of[n["content_id"]]
+    for parent_id in unsorted:
+        kids[parent_id].sort(key=key)
+    for step_type in unsorted_steps:
+        step_roots[step_type].sort(key=key)
+
+    return [{"step_type": st, "children": step_roots[st]} for st in sorted(step_roots)]
 
 
 # ============================================================
@@ -678,7 +786,133 @@ def migrate_legacy_blocks(legacy_rows, item_type=None, is_instruction=False):
 # ============================================================
 # 簡易自我測試（python -m modules.block_tree）：驗 §5.2 編號向量
 # ============================================================
+# ============================================================
+# 微基準：python -m modules.block_tree --bench [節點數 ...]
+# 跟舊的遞迴版（_legacy_*）比速度，並順便對帳兩邊輸出一致
+# （實測 flatten_tree 快約 1/4 ~ 1/3；build_tree 與舊版持平，見 build_tree docstring）
+# ============================================================
+def _legacy_flatten_tree(step_trees, document_token, id_factory):
+    rows = []
+
+    def walk(node, step_type, parent_id, depth, sort_order):
+        cid = id_factory()
+        row = {k: node.get(k) for k in _PAYLOAD_KEYS}
+        row["content_type"] = int(node.get("content_type", CT_EMPTY) or CT_EMPTY)
+        row.update(content_id=cid, document_token=document_token, step_type=step_type,
+                   parent_id=parent_id, sort_order=sort_order, depth=depth)
+        rows.append(row)
+        for idx, child in enumerate(node.get("children") or [], start=1):
+            walk(child, step_type, cid, depth + 1, idx)
+
+    for step in step_trees:
+        for idx, node in enumerate(step.get("children") or [], start=1):
+            walk(node, int(step["step_type"]), None, 2, idx)
+    return rows
+
+
+def _legacy_build_tree(flat_rows):
+    by_id = {}
+    for r in flat_rows:
+        node = {k: r.get(k) for k in _PAYLOAD_KEYS}
+        node["content_id"] = r["content_id"]
+        node["children"] = []
+        node["_sort_order"] = r.get("sort_order") or 0
+        by_id[r["content_id"]] = node
+    step_roots = {}
+    for r in flat_rows:
+        node = by_id[r["content_id"]]
+        parent_id = r.get("parent_id")
+        if parent_id and parent_id in by_id:
+            by_id[parent_id]["children"].append(node)
+        else:
+            step_roots.setdefault(int(r["step_type"]), []).append(node)
+
+    def sort_children(node):
+        node["children"].sort(key=lambda n: n["_sort_order"])
+        for c in node["children"]:
+            sort_children(c)
+        node.pop("_sort_order", None)
+
+    out = []
+    for step_type in sorted(step_roots.keys()):
+        roots = step_roots[step_type]
+        roots.sort(key=lambda n: n["_sort_order"])
+        for root in roots:
+            sort_children(root)
+        out.append({"step_type": step_type, "children": roots})
+    return out
+
+
+def _bench_tree(n_nodes, seed=0):
+    """造一棵約 n_nodes 個節點的式樣書樹（step 4-7，深度 ≤ MAX_DEPTH，含參數表 leaf）。"""
+    import random
+    rnd = random.Random(seed)
+    steps = {st: [] for st in (4, 5, 6, 7)}
+    frontier = []   # (children list, depth)
+    made = 0
+    while made < n_nodes:
+        if frontier and rnd.random() < 0.7:
+            siblings, depth = frontier[rnd.randrange(len(frontier))]
+        else:
+            siblings, depth = steps[rnd.choice((4, 5, 6, 7))], 2
+        is_param = depth == 2 and rnd.random() < 0.2
+        node = {
+            "client_id": f"c{made}",
+            "content_type": CT_PARAM if is_param else CT_TEXT,
+            "header_text": f"標題 {made}",
+            "header_json": {"type": "doc", "content": [{"type": "paragraph"}]},
+            "content_text": None if is_param else f"內容 {made}",
+            "content_json": None if is_param else {"type": "doc", "content": [{"type": "paragraph"}]},
+            "table_text": [["槽體", "管理項目", "設定值"]] if is_param else None,
+            "table_json": {"parameterTable": None, "conditionTable": None} if is_param else None,
+            "files": [], "metadata": {}, "children": [],
+        }
+        siblings.append(node)
+        made += 1
+        if not is_param and depth < MAX_DEPTH:
+            frontier.append((node["children"], depth + 1))
+    return [{"step_type": st, "children": ch} for st, ch in steps.items()]
+
+
+def _run_bench(sizes=(1000, 10000, 50000), repeat=5):
+    import gc
+    import time
+
+    def best(fn):
+        t = []
+        for _ in range(repeat):
+            gc.collect()   # 上一輪留下的垃圾別算到這一輪
+            t0 = time.perf_counter()
+            fn()
+            t.append(time.perf_counter() - t0)
+        return min(t) * 1000
+
+    print(f"{'nodes':>7} | {'flatten old':>11} {'new':>8} | {'build old':>9} {'new':>8}   (ms, best of {repeat})")
+    for n in sizes:
+        tree = _bench_tree(n)
+        # 與 DB 載入同條件：rows 依 ORDER BY step_type, sort_order 排好
+        seq = iter(range(10 ** 9))
+        ids = lambda: f"id{next(seq)}"
+        rows, _ = flatten_tree(tree, "bench", id_factory=ids)
+        seq = iter(range(10 ** 9))
+        assert rows == _legacy_flatten_tree(tree, "bench", ids), "flatten_tree 輸出與舊版不一致"
+        db_rows = sorted(rows, key=lambda r: (r["step_type"], r["sort_order"]))
+        assert build_tree(db_rows) == _legacy_build_tree(db_rows), "build_tree 輸出與舊版不一致"
+
+        f_old = best(lambda: _legacy_flatten_tree(tree, "bench", new_token))
+        f_new = best(lambda: flatten_tree(tree, "bench"))
+        b_old = best(lambda: _legacy_build_tree(db_rows))
+        b_new = best(lambda: build_tree(db_rows))
+        print(f"{len(rows):>7} | {f_old:>11.1f} {f_new:>8.1f} | {b_old:>9.1f} {b_new:>8.1f}")
+
+
 if __name__ == "__main__":
+    import sys
+    if "--bench" in sys.argv:
+        _sizes = [int(a) for a in sys.argv[1:] if a.isdigit()]
+        _run_bench(_sizes or (1000, 10000, 50000))
+        sys.exit(0)
+
     cases = [
         (2, [1], "2.1"),
         (2, [1, 3], "2.1.3"),
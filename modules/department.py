@@ -6,8 +6,13 @@
 #   - 課別權威為 Oracle IDBUSER.RMS_DEPT，本模組不維護課別主表
 #   - MySQL 只存 rms_department_process (M:N 綁定)
 #   - 可視範圍規則: { 自己 DEPT } ∪ { descendants } ∪ { parent (限 KJ 樹內) }
+#   - 可視範圍走 in-memory 課別索引（_DeptIndex），定期背景重建；索引不可用時退回即時查 Oracle
+
+import time
+import threading
 
 from flask import Blueprint, request, jsonify
+from config import DEPT_INDEX_TTL
 from db import db
 from oracle_db import ora_cursor
 
@@ -25,6 +30,150 @@ _PROCESS_WHERE_PREFIX = (
 _DEPT_TREE_FILTER = "KJ%"
 
 
+# ============================================================
+# In-memory 課別索引（可視範圍用）
+# ============================================================
+class _DeptIndex:
+    """
+    RMS_DEPT 鄰接表 + 每個課別預先算好的 descendants（含自己）+ 課別→員工 / 員工→課別。
+    載入整張 RMS_DEPT（不只 KJ%）：原本 CONNECT BY 從使用者課別往下走時不限 KJ，語意保持一致。
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.parent_of = {}        # dept -> GL_DEPARTMENT_CODE
+        self.descendants = {}      # dept -> frozenset(subtree，含自己)
+        self.user_dept = {}        # emp -> dept
+        self.dept_emps = {}        # dept -> [emp]
+        self.loaded_at = None      # time.time()
+        self.refreshing = False
+        self.stats = {"refreshes": 0, "refresh_failures": 0, "last_refresh_ms": None,
+                      "last_error": None, "hits": 0, "fallbacks": 0}
+
+    @staticmethod
+    def _build_descendants(parent_of):
+        children = {}
+        for dept, parent in parent_of.items():
+            if parent:
+                children.setdefault(parent, []).append(dept)
+
+        descendants = {}
+        for root in parent_of:
+            if root in descendants:
+                continue
+            # 迭代後序走訪：子樹算完才合併到父節點（避免深樹遞迴；visiting 擋掉資料環）
+            stack, visiting = [(root, False)], set()
+            while stack:
+                dept, expanded = stack.pop()
+                if expanded:
+                    acc = {dept}
+                    for c in children.get(dept, ()):
+                        acc |= descendants.get(c, frozenset())
+                    descendants[dept] = frozenset(acc)
+                    continue
+                if dept in descendants or dept in visiting:
+                    continue
+                visiting.add(dept)
+                stack.append((dept, True))
+                for c in children.get(dept, ()):
+                    if c not in descendants and c not in visiting:
+                        stack.append((c, False))
+        return descendants
+
+    def refresh(self):
+        t0 = time.monotonic()
+        try:
+            with ora_cursor() as cur:
+                cur.arraysize = 2000
+                cur.execute("SELECT DEPT_NO, GL_DEPARTMENT_CODE FROM IDBUSER.RMS_DEPT")
+                parent_of = {r[0]: r[1] for r in cur.fetchall()}
+                cur.execute("SELECT EMP_NO, DEPT_NO FROM IDBUSER.RMS_USERS")
+                user_rows = cur.fetchall()
+        except Exception as e:
+            with self.lock:
+                self.stats["refresh_failures"] += 1
+                self.stats["last_error"] = str(e)
+            raise
+        finally:
+            with self.lock:
+                self.refreshing = False
+
+        user_dept, dept_emps = {}, {}
+        for emp, dept in user_rows:
+            user_dept[emp] = dept
+            dept_emps.setdefault(dept, []).append(emp)
+        descendants = self._build_descendants(parent_of)
+
+        with self.lock:
+            self.parent_of, self.descendants = parent_of, descendants
+            self.user_dept, self.dept_emps = user_dept, dept_emps
+            self.loaded_at = time.time()
+            self.stats["refreshes"] += 1
+            self.stats["last_refresh_ms"] = round((time.monotonic() - t0) * 1000, 1)
+            self.stats["last_error"] = None
+
+    def _refresh_in_background(self):
+        with self.lock:
+            if self.refreshing:
+                return
+            self.refreshing = True
+
+        def run():
+            try:
+                self.refresh()
+            except Exception as e:
+                print(f"[dept index] background refresh failed: {e}")
+
+        threading.Thread(target=run, name="dept-index-refresh", daemon=True).start()
+
+    def ensure_loaded(self):
+        """沒載過 → 同步載；過期 → 背景重建、先用舊的。回傳索引是否可用。"""
+        if self.loaded_at is None:
+            try:
+                self.refresh()
+            except Exception as e:
+                print(f"[dept index] initial load failed: {e}")
+                return False
+            return True
+        if time.time() - self.loaded_at > DEPT_INDEX_TTL:
+            self._refresh_in_background()
+        return True
+
+    def visible_depts(self, user_emp_id):
+        with self.lock:
+            self.stats["hits"] += 1
+            user_dept = self.user_dept.get(str(user_emp_id))
+            if not user_dept or user_dept not in self.parent_of:
+                return []
+            depts = set(self.descendants.get(user_dept, {user_dept}))
+            parent_dept = self.parent_of.get(user_dept)
+        if parent_dept and parent_dept.startswith("KJ"):
+            depts.add(parent_dept)
+        return sorted(depts)
+
+    def emps_in(self, depts):
+        with self.lock:
+            return [emp for d in depts for emp in self.dept_emps.get(d, ())]
+
+    def status(self):
+        with self.lock:
+            age = None if self.loaded_at is None else round(time.time() - self.loaded_at, 1)
+            return {
+                "loaded": self.loaded_at is not None,
+                "loadedAt": time.strftime("%Y-%m-%d %H:%M:%S", time.localtime(self.loaded_at)) if self.loaded_at else None,
+                "ageSeconds": age,
+                "ttlSeconds": DEPT_INDEX_TTL,
+                "stale": age is None or age > DEPT_INDEX_TTL,
+                "refreshing": self.refreshing,
+                "depts": len(self.parent_of),
+                "users": len(self.user_dept),
+                **self.stats,
+            }
+
+
+_dept_index = _DeptIndex()
+
+
 # ============================================================
 # Visibility Helpers (給 docs.py /drafts /passed 共用)
 # ============================================================
@@ -36,7 +185,15 @@ def get_visible_dept_codes(user_emp_id):
     """
     if not user_emp_id:
         return []
+    if _dept_index.ensure_loaded():
+        return _dept_index.visible_depts(user_emp_id)
+    with _dept_index.lock:
+        _dept_index.stats["fallbacks"] += 1
+    return _get_visible_dept_codes_oracle(user_emp_id)
+
 
+def _get_visible_dept_codes_oracle(user_emp_id):
+    """索引不可用時的退路：即時查 Oracle（原本的做法）。"""
     try:
         with ora_cursor() as cur:
             # 1. 撈使用者 dept + parent
@@ -84,6 +241,9 @@ def get_visible_emp_ids(user_emp_id):
     if not visible_depts:
         return [user_emp_id] if user_emp_id else []
 
+    if _dept_index.loaded_at is not None:
+        return _dept_index.emps_in(visible_depts)
+
     try:
         with ora_cursor() as cur:
             binds = {f"d{i}": v for i, v in enumerate(visible_depts)}
@@ -136,6 +296,23 @@ def _fetch_process_count_map():
 # ============================================================
 # Endpoints
 # ============================================================
+@bp.get("/index/status")
+def dept_index_status():
+    """可視範圍課別索引狀態（載入時間、過期與否、筆數、命中 / 退回 Oracle 次數）"""
+    return jsonify({"success": True, "data": _dept_index.status()})
+
+
+@bp.post("/index/refresh")
+def dept_index_refresh():
+    """立即重建可視範圍課別索引（組織異動後手動觸發）"""
+    try:
+        _dept_index.refresh()
+        return jsonify({"success": True, "data": _dept_index.status()})
+    except Exception as e:
+        print(f"Error in /department/index/refresh: {e}")
+        return jsonify({"success": False, "error": str(e)}), 500
+
+
 @bp.get("/tree")
 def get_department_tree():
     """KJ 課別樹狀結構，每節點附帶 processCount"""
@@ -1,22 +1,66 @@
 # media.py
-from flask import Blueprint, request, jsonify, send_from_directory
+from flask import Blueprint, Response, request, jsonify, send_file
+from werkzeug.security import safe_join
 from werkzeug.utils import secure_filename
-import os, tempfile, uuid, subprocess, platform, mimetypes
-from datetime import datetime
-from config import UPLOAD_ROOT_DIR, ALLOWED_EXTS, DRAWIO_CLI_PATH
+import os, stat, uuid, mimetypes
+from config import UPLOAD_ROOT_DIR, ALLOWED_EXTS, UPLOAD_SENDFILE
 from db import db
+from image_normalize import normalize_file
+from asset_store import store_stream, storage_key, key_path, record_asset, collect_garbage
+import drawio_service
 
 bp = Blueprint("uploads", __name__)
 
 def allowed_file(fn): 
     return '.' in fn and fn.rsplit('.',1)[1].lower() in ALLOWED_EXTS
 
+# ==========================================================
+# 檔案服務：ETag / 304 / Range，CAS 路徑永久快取；可交給前端 proxy 送檔
+# ==========================================================
+_IMMUTABLE_MAX_AGE = 365 * 24 * 3600
+
+
+def _send_upload(filename, as_attachment=False):
+    full_path = safe_join(UPLOAD_ROOT_DIR, filename)
+    try:
+        st = os.stat(full_path) if full_path else None
+    except OSError:
+        st = None
+    if st is None or not stat.S_ISREG(st.st_mode):
+        return "File Not Found", 404
+
+    # CAS 檔（temp/cas/...）檔名就是內容 hash，內容永遠不會變 → 強 ETag = 檔名、immutable；
+    # 其餘（舊日期目錄）用 mtime + size 當 ETag，每次都要 revalidate（沒變回 304）
+    immutable = filename.startswith("temp/cas/")
+    etag = os.path.basename(filename) if immutable else f"{st.st_mtime_ns:x}-{st.st_size:x}"
+    cache_control = f"public, max-age={_IMMUTABLE_MAX_AGE}, immutable" if immutable else "no-cache"
+
+    mode = UPLOAD_SENDFILE["mode"]
+    if mode in ("x-accel", "x-sendfile"):
+        resp = Response(status=200, mimetype=mimetypes.guess_type(filename)[0] or "application/octet-stream")
+        resp.set_etag(etag)
+        resp.last_modified = st.st_mtime
+        if as_attachment:
+            resp.headers["Content-Disposition"] = f'attachment; filename="{os.path.basename(filename)}"'
+        resp.headers["Cache-Control"] = cache_control
+        resp = resp.make_conditional(request)   # If-None-Match 命中 → 304，不必再轉給 proxy
+        if resp.status_code == 200:
+            if mode == "x-accel":
+                resp.headers["X-Accel-Redirect"] = UPLOAD_SENDFILE["accel_prefix"].rstrip("/") + "/" + filename
+            else:
+                resp.headers["X-Sendfile"] = full_path
+        return resp
+
+    # conditional=True：If-None-Match / If-Modified-Since → 304、Range → 206（werkzeug 處理）
+    resp = send_file(full_path, as_attachment=as_attachment, conditional=True, etag=etag,
+                     last_modified=st.st_mtime, max_age=_IMMUTABLE_MAX_AGE if immutable else None)
+    resp.headers["Cache-Control"] = cache_control
+    return resp
+
+
 @bp.get("/<path:filename>")
 def serve_file(filename):
-    full_path = os.path.join(UPLOAD_ROOT_DIR, filename)
-    if not os.path.exists(full_path):
-        return "File Not Found", 404
-    return send_from_directory(UPLOAD_ROOT_DIR, filename)
+    return _send_upload(filename)
 
 @bp.post("/image")
 def upload_image():
@@ -38,31 +82,46 @@ def upload_image():
         if ext == '.jpe':
             ext = '.jpg'
 
-    subdir = os.path.join(UPLOAD_ROOT_DIR, 'temp', datetime.now().strftime('%Y/%m/%d'))
-    os.makedirs(subdir, exist_ok=True)
-
-    fd, abs_path = tempfile.mkstemp(dir=subdir, suffix=ext); os.close(fd)
-    f.save(abs_path)
+    # content-addressed：檔名 = 內容 sha256（uploads/temp/cas/ab/<sha256>.<ext>），同一張圖只存一份
+    abs_path, digest, size, created = store_stream(f.stream, ext)
+    key = storage_key(abs_path)
 
-    abstract_path = os.path.relpath(abs_path, UPLOAD_ROOT_DIR).replace(os.sep, '/')
-    browser_url   = f"/uploads/{abstract_path}"
-    download_url  = f"/uploads/download/{abstract_path}"   # ★ 專用下載路徑
+    # 正規化衍生檔（轉正 / 縮到可列印寬度 / 去 EXIF / 重壓）：給 Word 渲染用，失敗不影響上傳
+    # 同內容早就傳過 → 衍生檔也已經有了，不必再跑
+    norm_path, norm_info = None, {}
+    if created:
+        try:
+            norm_path, norm_info = normalize_file(abs_path)
+        except Exception as e:
+            print(f"[upload_image] normalize {key} failed: {e}")
 
-    asset_id = str(uuid.uuid4())
+    asset_id = None
     try:
         with db() as (conn, cur):
-            cur.execute("""
-              INSERT INTO rms_assets (asset_id, storage_key, mime_type, byte_size, created_at)
-              VALUES (%s,%s,%s,%s,NOW())
-            """, (asset_id, f"uploads/{abstract_path}", f.mimetype, os.path.getsize(abs_path)))
-            if token:
+            # rms_assets 以 content_hash 去重：已存在 → 沿用原本的 asset / storage_key
+            asset_id, stored_key, inserted = record_asset(cur, abs_path, f.mimetype, digest, size=size, token=token)
+            if inserted and norm_path:
                 cur.execute("""
-                  INSERT INTO rms_asset_links (asset_id, document_token, content_id, created_at)
-                  VALUES (%s, %s, %s, NOW())
-                """, (asset_id, token, None))
-    except Exception:
+                  INSERT IGNORE INTO rms_assets (asset_id, storage_key, mime_type, byte_size, variant, source_asset_id,
+                                                 width_px, height_px, created_at)
+                  VALUES (%s,%s,%s,%s,'normalized',%s,%s,%s,NOW())
+                """, (str(uuid.uuid4()), storage_key(norm_path), f.mimetype, norm_info.get("bytes"), asset_id,
+                      norm_info.get("width"), norm_info.get("height")))
+            if stored_key != key and os.path.exists(key_path(stored_key)):
+                if created:
+                    # 同內容換副檔名重傳：新檔和剛產的衍生檔都沒有 row（GC 收不到）→ 一起刪，沿用原本那份
+                    for p in (abs_path, norm_path):
+                        if p and os.path.exists(p):
+                            os.remove(p)
+                key = stored_key
+    except Exception as e:
+        print(f"[upload_image] asset record failed: {e}")
         asset_id = None
 
+    abstract_path = key.split("/", 1)[1]
+    browser_url   = f"/uploads/{abstract_path}"
+    download_url  = f"/uploads/download/{abstract_path}"   # ★ 專用下載路徑
+
     payload = {"success": True, "url": browser_url, "path_to_save": abstract_path, "download_url": download_url}
     if asset_id:
         payload["asset_id"] = asset_id
@@ -70,86 +129,78 @@ def upload_image():
 
 @bp.get("/download/<path:filename>")
 def download_file(filename):
-    full_path = os.path.join(UPLOAD_ROOT_DIR, filename)
-    if not os.path.exists(full_path):
-        return "File Not Found", 404
-    return send_from_directory(UPLOAD_ROOT_DIR, filename, as_attachment=True)
+    return _send_upload(filename, as_attachment=True)
 
 
-@bp.post("/drawio")
-def upload_drawio_and_convert():
+def _drawio_upload():
+    """共用前置檢查：回傳 (in_path, digest, token) 或 (None, error response)。"""
     # accept either 'file' or 'drawioFile'
     f = request.files.get('file') or request.files.get('drawioFile')
     if not f:
-        return jsonify({"success": False, "message": "No drawio file"}), 400
+        return None, (jsonify({"success": False, "message": "No drawio file"}), 400)
     if not f.filename.lower().endswith(".drawio"):
-        return jsonify({"success": False, "message": "Not a .drawio file"}), 400
+        return None, (jsonify({"success": False, "message": "Not a .drawio file"}), 400)
 
     token = (request.args.get("token") or "").strip()
+    # .drawio 以內容 sha256 存進 CAS（同一張圖重傳 → 同一個檔 / 同一份 PNG 快取）
+    in_path, digest = drawio_service.save_drawio(f.stream)
+    return (in_path, digest, token), None
 
-    original = secure_filename(f.filename)
-    ext = ('.' + original.rsplit('.', 1)[1].lower()) if '.' in original else ''
-    daydir = os.path.join(UPLOAD_ROOT_DIR, 'temp', datetime.now().strftime('%Y/%m/%d'))
-    os.makedirs(daydir, exist_ok=True)
-
-    # 1) save input .drawio
-    fd, in_path = tempfile.mkstemp(dir=daydir, suffix=".drawio")
-    os.close(fd)
-    f.save(in_path)
-
-    # 2) choose an output name
-    fd, out_path = tempfile.mkstemp(dir=daydir, suffix=".png")
-    os.close(fd)
 
+@bp.post("/drawio")
+def upload_drawio_and_convert():
+    """同步轉檔（舊前端）：內容沒變直接回快取的 PNG；否則排進轉檔池等它做完。"""
+    args, err = _drawio_upload()
+    if err:
+        return err
     try:
-        if platform.system() == "Windows":
-            print("Window drawio to png")
-            subprocess.run(
-                [DRAWIO_CLI_PATH, "-x", in_path, "--format", "png", "--output", out_path],
-                check=True, capture_output=True, text=True, creationflags=0
-            )
-        elif platform.system() == "Linux":
-            print("Ubuntu drawio to png")
-            subprocess.run(
-                ["xvfb-run", DRAWIO_CLI_PATH, "-x", in_path, "--format", "png", "--output", out_path, "--no-sandbox"],
-                check=True, capture_output=True, text=True
-            )
-    except FileNotFoundError:
+        return jsonify(drawio_service.convert(*args)), 200
+    except drawio_service.ConvertError as e:
         # 轉檔失敗也不要亂刪，讓管理員可以排查
-        return jsonify({"success": False, "message": "DRAWIO_CLI_PATH not found. Check config.DRAWIO_CLI_PATH"}), 500
-    except subprocess.CalledProcessError as e:
-        return jsonify({"success": False, "message": f"Draw.io convert failed: {e.stderr or e}"}), 500
-
-    if not os.path.exists(out_path):
-        return jsonify({"success": False, "message": "Conversion produced no PNG"}), 500
-
-    # 3) 計算路徑（PNG + 原始 drawio 都保留）
-    abstract_path = os.path.relpath(out_path, UPLOAD_ROOT_DIR).replace(os.sep, '/')
-    browser_url   = f"/uploads/{abstract_path}"
-    download_url  = f"/uploads/download/{abstract_path}"  # 使用同一個下載端點
-
-    source_abstract_path = os.path.relpath(in_path, UPLOAD_ROOT_DIR).replace(os.sep, '/')
-    source_url           = f"/uploads/download/{source_abstract_path}"
-
-    # 4) persist PNG as an asset（你如果也想把 .drawio 存進 rms_assets 可以再加一組 INSERT）
-    asset_id = str(uuid.uuid4())
+        return jsonify({"success": False, "message": str(e)}), 500
+    except TimeoutError as e:
+        return jsonify({"success": False, "message": str(e)}), 504
+
+
+# ==========================================================
+# 非同步轉檔：submit → 輪詢 status（done 時直接帶結果）
+# ==========================================================
+@bp.post("/drawio/jobs")
+def submit_drawio_job():
+    args, err = _drawio_upload()
+    if err:
+        return err
+    hit = drawio_service.cached_result(*args)
+    if hit is not None:
+        return jsonify({"success": True, "data": {"status": "done", "result": hit}}), 200
+    job_id = drawio_service.submit(*args)
+    return jsonify({"success": True, "data": drawio_service.status(job_id)}), 202
+
+
+@bp.get("/drawio/jobs/<job_id>")
+def drawio_job_status(job_id):
+    status = drawio_service.status(job_id)
+    if status is None:
+        return jsonify({"success": False, "message": "job not found or expired"}), 404
+    if status["status"] == "done":
+        status["result"] = drawio_service.result(job_id)
+    return jsonify({"success": True, "data": status})
+
+
+@bp.get("/drawio/jobs")
+def drawio_queue_stats():
+    return jsonify({"success": True, "data": drawio_service.drawio_queue.stats()})
+
+
+# ==========================================================
+# CAS 上傳檔 GC：沒有任何草稿 / 快照參照、超過寬限期的檔案（?dry_run=1 只列數量不刪）
+# ==========================================================
+@bp.post("/gc")
+def gc_assets():
+    dry_run = request.args.get("dry_run") == "1"
+    grace = request.args.get("grace_seconds", type=int)
     try:
-        with db() as (conn, cur):
-            cur.execute("""
-              INSERT INTO rms_assets (asset_id, storage_key, mime_type, byte_size, created_at)
-              VALUES (%s,%s,%s,%s,NOW())
-            """, (asset_id, f"uploads/{abstract_path}", "image/png", os.path.getsize(out_path)))
-            if token:
-                cur.execute("""
-                  INSERT INTO rms_asset_links (asset_id, document_token, content_id, created_at)
-                  VALUES (%s, %s, %s, NOW())
-                """, (asset_id, token, None))
-    except Exception:
-        asset_id = None
-
-    payload = {"success": True, "url": browser_url, "path_to_save": abstract_path, "download_url": source_url}
-
-    if asset_id:
-        payload["asset_id"] = asset_id
-        
-    return jsonify(payload), 200
+        return jsonify({"success": True, "data": collect_garbage(grace_seconds=grace, dry_run=dry_run)})
+    except Exception as e:
+        print(f"[asset_gc] error: {e}")
+        return jsonify({"success": False, "message": str(e)}), 500
@@ -0,0 +1,144 @@
+# modules/personnel.py
+#
+# 簽核人員（確認者 confirmer / 核准者 approver）解析 + 快取。
+#
+# 規則（與原本 docs.py 內嵌的 5-way join 相同）:
+#   - confirmer = 使用者所屬課 (RMS_DEPT) 的主管姓名
+#   - approver  = 上層部門 (GL_DEPARTMENT_CODE) 的主管姓名
+#   - 只看在職 (OUT_DATE IS NULL) 的使用者
+#
+# 設計重點:
+#   - 依 emp_id 的 in-process TTL 快取（組織異動很少，不必每次開文件都打 Oracle）；
+#     LRU 上限 PERSONNEL_CACHE_MAX 筆（查無的工號也會快取，不設上限會一直長），過期的在整批預載時順便清掉
+#   - SQL 一律 bind 變數（避免 injection，也讓 statement cache 生效）
+#   - PERSONNEL_PREFETCH=1 時，背景 thread 定期整批撈「全體在職人員 → 主管」對照表；
+#     對照表裡查不到（例如剛到職）才退回單筆查詢
+
+import time
+import threading
+from collections import OrderedDict
+
+from config import PERSONNEL_CACHE
+from oracle_db import ora_cursor
+
+_PERSONNEL_SQL = """
+    SELECT A.EMP_NO, C.EMPNAME, E.EMPNAME FROM IDBUSER.RMS_USERS A
+    INNER JOIN IDBUSER.RMS_DEPT B ON A.DEPT_NO = B.DEPT_NO
+    LEFT JOIN IDBUSER.RMS_USERS C ON B.LEADER_EMP_ID = C.EMP_NO
+    LEFT JOIN IDBUSER.RMS_DEPT D ON B.GL_DEPARTMENT_CODE = D.DEPT_NO
+    LEFT JOIN IDBUSER.RMS_USERS E ON D.LEADER_EMP_ID = E.EMP_NO
+    WHERE A.OUT_DATE IS NULL
+"""
+
+_lock = threading.Lock()
+_cache = OrderedDict()      # emp_id -> (expires_at, personnel | None)，最近用到的在尾端
+_bulk = {"map": None, "loaded_at": None}
+_prefetch_started = False
+
+
+def _row_to_personnel(row):
+    return {"confirmer": row[1] or "", "approver": row[2] or ""}
+
+
+def _query_one(emp_id):
+    with ora_cursor() as cur:
+        cur.execute(_PERSONNEL_SQL + " AND A.EMP_NO = :emp_id", emp_id=emp_id)
+        row = cur.fetchone()
+    return _row_to_personnel(row) if row else None
+
+
+def refresh_bulk():
+    """整批重撈「在職人員 → 主管」對照表；回傳筆數。失敗保留舊表。"""
+    with ora_cursor() as cur:
+        cur.arraysize = 2000
+        cur.execute(_PERSONNEL_SQL)
+        mapping = {row[0]: _row_to_personnel(row) for row in cur.fetchall()}
+    with _lock:
+        _bulk["map"] = mapping
+        _bulk["loaded_at"] = time.time()
+    sweep_expired()
+    return len(mapping)
+
+
+def sweep_expired():
+    """清掉已過期的單筆快取；回傳清掉幾筆。"""
+    now = time.time()
+    with _lock:
+        expired = [k for k, (expires_at, _) in _cache.items() if expires_at <= now]
+        for k in expired:
+            del _cache[k]
+    return len(expired)
+
+
+def _prefetch_loop(interval):
+    while True:
+        try:
+            n = refresh_bulk()
+            print(f"[personnel] bulk prefetch loaded {n} users")
+        except Exception as e:
+            print(f"[personnel] bulk prefetch failed: {e}")
+        time.sleep(interval)
+
+
+def start_prefetch():
+    """啟動背景整批預載（只會啟一次）。"""
+    global _prefetch_started
+    with _lock:
+        if _prefetch_started:
+            return
+        _prefetch_started = True
+    t = threading.Thread(target=_prefetch_loop, args=(PERSONNEL_CACHE["prefetch_interval"],),
+                         name="personnel-prefetch", daemon=True)
+    t.start()
+
+
+def _bulk_lookup(emp_id):
+    """對照表夠新才用（背景 thread 掛掉時不會一直拿舊資料）。"""
+    with _lock:
+        mapping, loaded_at = _bulk["map"], _bulk["loaded_at"]
+    if mapping is None or time.time() - loaded_at > PERSONNEL_CACHE["prefetch_interval"] * 2:
+        return None
+    return mapping.get(emp_id)
+
+
+def resolve_personnel(emp_id):
+    """
+    emp_id → {"confirmer": 姓名, "approver": 姓名}；查無（離職 / 不存在）回 None。
+    Oracle 失敗直接丟例外，由呼叫端決定要回錯誤還是給空值。
+    """
+    emp_id = str(emp_id or "").strip()
+    if not emp_id:
+        return None
+
+    if PERSONNEL_CACHE["prefetch"]:
+        start_prefetch()
+        hit = _bulk_lookup(emp_id)
+        if hit is not None:
+            return dict(hit)
+
+    now = time.time()
+    with _lock:
+        cached = _cache.get(emp_id)
+        if cached and cached[0] > now:
+            _cache.move_to_end(emp_id)
+    if cached and cached[0] > now:
+        return dict(cached[1]) if cached[1] else None
+
+    personnel = _query_one(emp_id)
+    # 查無也快取（較短），避免打錯工號的重試一直打 Oracle
+    ttl = PERSONNEL_CACHE["ttl"] if personnel else min(PERSONNEL_CACHE["ttl"], 60)
+    with _lock:
+        _cache[emp_id] = (now + ttl, personnel)
+        _cache.move_to_end(emp_id)
+        while len(_cache) > PERSONNEL_CACHE["max_entries"]:
+            _cache.popitem(last=False)
+    return dict(personnel) if personnel else None
+
+
+def invalidate(emp_id=None):
+    """清快取（不帶 emp_id → 全清）。"""
+    with _lock:
+        if emp_id is None:
+            _cache.clear()
+        else:
+            _cache.pop(str(emp_id).strip(), None)
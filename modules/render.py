@@ -0,0 +1,110 @@
+# modules/render.py
+from __future__ import annotations
+import os, uuid
+
+from flask import Blueprint, request, jsonify, send_file
+
+from render_worker import submit_render, render_queue, QueueFull
+from render_cache import render_cache
+from modules.docs import BASE_DIR, _draft_docx_job, _latest_snapshot, _snapshot_docx_job
+
+bp = Blueprint("render", __name__)
+
+RENDER_DIR = os.path.join(BASE_DIR, "_render")
+DOCX_MIMETYPE = "application/vnd.openxmlformats-officedocument.wordprocessingml.document"
+
+
+def _public_status(status):
+    # out_path 是伺服器內部路徑，不回給前端
+    status["meta"] = {k: v for k, v in status["meta"].items() if k not in ("out_path", "owned")}
+    return status
+
+
+@bp.app_errorhandler(QueueFull)
+def _queue_full(e):
+    # 同步包裝（/preview/*、/generate/*、/view/*）也走同一個佇列，滿了一律回 503 讓前端稍後重試（draw.io 轉檔佇列共用）
+    return jsonify({"success": False, "message": f"佇列已滿，請稍後再試（{e}）"}), 503
+
+
+# ==========================================================
+# 非同步渲染 API：submit → 輪詢 status → done 後 fetch
+# ==========================================================
+@bp.post("/jobs")
+def submit_job():
+    """
+    body：
+      { "source": "draft" | "snapshot", "token": "...", "rms_id": "...(snapshot 選填)",
+        "renderer": "framework" | "no_framework", "protect": bool }
+    draft    → 依 DB 目前草稿即時組 payload（同 /docs/view/<token>/docx）
+    snapshot → 最新（或指定 rms_id）快照（同 /docs/preview/<token>）
+    """
+    data = request.get_json(silent=True) or {}
+    source = data.get("source", "draft")
+    token = data.get("token")
+    renderer = data.get("renderer", "framework")
+    if not token:
+        return jsonify({"success": False, "message": "token is required"}), 400
+    if renderer not in ("framework", "no_framework"):
+        return jsonify({"success": False, "message": f"unknown renderer: {renderer}"}), 400
+
+    try:
+        if source == "draft":
+            payload, template, doc_name = _draft_docx_job(token)
+            protect = bool(data.get("protect", False))
+        elif source == "snapshot":
+            snap = _latest_snapshot(token, data.get("rms_id"))
+            if not snap:
+                return jsonify({"success": False, "message": "snapshot not found"}), 404
+            payload, template, doc_name = _snapshot_docx_job(snap)
+            protect = bool(data.get("protect", True))
+        else:
+            return jsonify({"success": False, "message": f"unknown source: {source}"}), 400
+    except Exception as e:
+        print("[render] build payload error:", e)
+        return jsonify({"success": False, "message": "document not found"}), 404
+
+    if renderer == "no_framework":
+        template = template.replace("Document.docx", "Documentv6.docx")
+
+    os.makedirs(RENDER_DIR, exist_ok=True)
+    out_path = os.path.join(RENDER_DIR, f"{uuid.uuid4().hex}.docx")
+    job_id = submit_render(renderer, out_path, payload, template, protect=protect,
+                           meta={"source": source, "token": token, "download_name": f"{doc_name}.docx"})
+    return jsonify({"success": True, "data": _public_status(render_queue.status(job_id))}), 202
+
+
+@bp.get("/jobs/<job_id>")
+def job_status(job_id):
+    status = render_queue.status(job_id)
+    if status is None:
+        return jsonify({"success": False, "message": "job not found or expired"}), 404
+    return jsonify({"success": True, "data": _public_status(status)})
+
+
+@bp.get("/jobs/<job_id>/file")
+def job_file(job_id):
+    status = render_queue.status(job_id)
+    if status is None:
+        return jsonify({"success": False, "message": "job not found or expired"}), 404
+    if status["status"] == "failed":
+        return jsonify({"success": False, "message": status.get("error")}), 500
+    if status["status"] != "done":
+        return jsonify({"success": False, "message": f"job is {status['status']}"}), 409
+
+    meta = status["meta"]
+    return send_file(
+        meta["out_path"],
+        as_attachment=request.args.get("download") == "1",
+        download_name=meta.get("download_name") or "document.docx",
+        mimetype=DOCX_MIMETYPE,
+    )
+
+
+@bp.get("/jobs")
+def queue_stats():
+    return jsonify({"success": True, "data": render_queue.stats()})
+
+
+@bp.get("/cache")
+def cache_stats():
+    return jsonify({"success": True, "data": render_cache.stats()})
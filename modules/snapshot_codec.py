@@ -0,0 +1,334 @@
+# modules/snapshot_codec.py
+"""
+快照 payload 壓縮格式（rms_document_snapshot_payloads.payload_blob）。
+
+舊格式：document_row / blocks_rows / references_rows / ... 各存一欄冗長 JSON（每一列都重複欄位名稱）。
+新格式（envelope）：
+    b"RSN" + version(1 byte) + codec(1 byte) + 壓縮後的 body
+    body = compact JSON：
+      { "tok": document_token,
+        "doc": document_row,
+        "blocks": {"cols": [欄位名...], "rows": [[值...], ...]},   ← 欄位名稱只存一次（columnar）
+        "refs":   {"cols": [...], "rows": [...]},
+        "programs": [...], "form": {...} }
+    每列的 document_token 都等於 tok → 不重複存，解碼時補回。
+codec：zstd（有裝 zstandard 才用）或 zlib；解碼依 header 自動判斷，兩種都讀得回來。
+
+version 2（區塊去重）：blocks 只存結構欄（content_id / parent_id / sort_order / depth ...）+ 內容 hash，
+區塊內容（header / content / table JSON、files、metadata）以 sha256 存進 rms_block_payloads 一次，
+連續版本 / 重複下載同一份草稿，沒改過的區塊只多一個 64 字元的 hash。
+encode / decode 本身不碰 DB：payloads 由呼叫端用 store_payloads / fetch_payloads（帶 cursor）存取。
+
+回收：快照（簽核 / 作廢 / 退回）會被刪，區塊內容不能跟著無限長。
+rms_snapshot_block_refs 記「哪個快照用到哪個 hash」（snapshot 刪掉 → ON DELETE CASCADE），
+collect_payloads() 刪掉已經沒有任何快照參照的 hash（同 asset_store.link_snapshot_assets / collect_garbage 的做法）。
+"""
+from __future__ import annotations
+
+import json
+import zlib
+import hashlib
+
+try:
+    import zstandard as _zstd
+except ImportError:   # 選用相依：沒裝就一律 zlib
+    _zstd = None
+
+MAGIC = b"RSN"
+VERSION = 1            # blocks 內容直接放在 envelope
+VERSION_BLOCK_REFS = 2 # blocks 只放結構欄 + 內容 hash（rms_block_payloads）
+CODEC_ZLIB = 0
+CODEC_ZSTD = 1
+
+_ZLIB_LEVEL = 6
+_ZSTD_LEVEL = 10
+
+# 區塊內容欄（= block_tree 的 payload 欄）；其餘欄位（content_id / parent_id / sort_order / depth / 時間戳…）算結構欄
+BLOCK_PAYLOAD_KEYS = (
+    "content_type", "header_text", "header_json", "content_text", "content_json",
+    "table_text", "table_json", "files", "metadata",
+)
+_PAYLOAD_CHUNK = 500
+
+# decode 後的欄位名稱（= rms_document_snapshot_payloads 舊 JSON 欄位）
+PAYLOAD_FIELDS = ("document_row", "blocks_rows", "references_rows", "program_codes_rows", "form_attributes")
+
+
+def default_codec(name: str = "auto") -> int:
+    """SNAPSHOT_CODEC 設定值 → codec 代碼（auto：有 zstandard 用 zstd，否則 zlib）。"""
+    if name == "zstd" or (name == "auto" and _zstd is not None):
+        if _zstd is None:
+            raise RuntimeError("SNAPSHOT_CODEC=zstd but the zstandard package is not installed")
+        return CODEC_ZSTD
+    return CODEC_ZLIB
+
+
+def is_envelope(blob) -> bool:
+    return isinstance(blob, (bytes, bytearray, memoryview)) and bytes(blob[:3]) == MAGIC
+
+
+# ==========================================================
+# columnar（欄位名稱字典）
+# ==========================================================
+def _to_columns(rows, token):
+    if not rows or not all(isinstance(r, dict) for r in rows):
+        return {"raw": rows}
+    cols, seen = [], set()
+    for r in rows:
+        for k in r:
+            if k not in seen:
+                seen.add(k)
+                cols.append(k)
+    drop_token = token is not None and all(r.get("document_token") == token for r in rows)
+    if drop_token:
+        cols.remove("document_token")
+    return {"cols": cols, "rows": [[r.get(c) for c in cols] for r in rows], "tok": drop_token}
+
+
+def _from_columns(table, token):
+    if "raw" in table:
+        return table["raw"]
+    cols = table["cols"]
+    rows = [dict(zip(cols, values)) for values in table["rows"]]
+    if table.get("tok"):
+        for r in rows:
+            r["document_token"] = token
+    return rows
+
+
+# ==========================================================
+# 區塊內容去重（version 2）
+# ==========================================================
+def _payload_json(payload):
+    return json.dumps(payload, ensure_ascii=False, sort_keys=True, separators=(",", ":"), default=str)
+
+
+def _split_blocks(rows, token, payloads):
+    """rows → 結構欄 columnar + 每列內容 hash；內容放進 payloads {hash: json}。不是攤平 rows（舊格式的樹）→ None。"""
+    if not rows or not all(isinstance(r, dict) and "content_id" in r for r in rows):
+        return None
+    order, seen = [], set()
+    for r in rows:
+        for k in r:
+            if k not in seen:
+                seen.add(k)
+                order.append(k)
+    pkeys = [k for k in order if k in BLOCK_PAYLOAD_KEYS]
+    structural = [{k: v for k, v in r.items() if k not in BLOCK_PAYLOAD_KEYS} for r in rows]
+    hashes = []
+    for r in rows:
+        payload = {k: r.get(k) for k in pkeys}
+        text = _payload_json(payload)
+        h = hashlib.sha256(text.encode("utf-8")).hexdigest()
+        payloads[h] = text
+        hashes.append(h)
+    table = _to_columns(structural, token)
+    table.update(h=hashes, order=order)
+    return table
+
+
+def _join_blocks(table, token, resolved):
+    rows = _from_columns(table, token)
+    order = table["order"]
+    out = []
+    for r, h in zip(rows, table["h"]):
+        payload = resolved.get(h)
+        if payload is None:
+            raise ValueError(f"block payload {h} missing from rms_block_payloads")
+        merged = {**r, **payload}
+        out.append({k: merged.get(k) for k in order})
+    return out
+
+
+# ==========================================================
+# envelope
+# ==========================================================
+def encode_snapshot(document_row, blocks_rows, references_rows, program_codes_rows, form_attributes,
+                    codec: int = CODEC_ZLIB, payloads: dict | None = None) -> bytes:
+    """
+    各欄位請先過 _normalize_for_json（Decimal / datetime → JSON 型別）。
+    payloads 給一個 dict → 區塊去重（version 2）：blocks 只存 hash，內容填進 payloads {hash: json 字串}，
+    呼叫端要在同一個 transaction 內 store_payloads() 存起來。blocks 不是攤平 rows → 自動退回 version 1。
+    """
+    token = document_row.get("document_token") if isinstance(document_row, dict) else None
+    blocks = _split_blocks(blocks_rows, token, payloads) if payloads is not None else None
+    version = VERSION_BLOCK_REFS if blocks is not None else VERSION
+    body = json.dumps(
+        {
+            "tok": token,
+            "doc": document_row,
+            "blocks": blocks if blocks is not None else _to_columns(blocks_rows, token),
+            "refs": _to_columns(references_rows, token),
+            "programs": program_codes_rows,
+            "form": form_attributes,
+        },
+        ensure_ascii=False, separators=(",", ":"), default=str,
+    ).encode("utf-8")
+    if codec == CODEC_ZSTD:
+        packed = _zstd.ZstdCompressor(level=_ZSTD_LEVEL).compress(body)
+    else:
+        packed = zlib.compress(body, _ZLIB_LEVEL)
+    return MAGIC + bytes((version, codec)) + packed
+
+
+def _body(blob):
+    version, codec = blob[3], blob[4]
+    if version not in (VERSION, VERSION_BLOCK_REFS):
+        raise ValueError(f"unsupported snapshot envelope version {version}")
+    packed = blob[5:]
+    if codec == CODEC_ZSTD:
+        if _zstd is None:
+            raise RuntimeError("snapshot is zstd-compressed but the zstandard package is not installed")
+        body = _zstd.ZstdDecompressor().decompress(packed)
+    elif codec == CODEC_ZLIB:
+        body = zlib.decompress(packed)
+    else:
+        raise ValueError(f"unknown snapshot codec {codec}")
+    return json.loads(body)
+
+
+def decode_snapshot(blob, resolve=None) -> dict:
+    """
+    envelope → {document_row, blocks_rows, references_rows, program_codes_rows, form_attributes}（python 物件）。
+    version 2 需要 resolve(hashes) → {hash: payload dict}（通常是 lambda hs: fetch_payloads(cur, hs)）。
+    """
+    blob = bytes(blob)
+    if not is_envelope(blob):
+        raise ValueError("not a snapshot envelope")
+    data = _body(blob)
+    token = data.get("tok")
+    table = data.get("blocks") or {"raw": []}
+    if "h" in table:
+        if resolve is None:
+            raise ValueError("snapshot references block payloads; resolve= is required")
+        blocks = _join_blocks(table, token, resolve(sorted(set(table["h"]))))
+    else:
+        blocks = _from_columns(table, token)
+    return {
+        "document_row": data.get("doc"),
+        "blocks_rows": blocks,
+        "references_rows": _from_columns(data.get("refs") or {"raw": []}, token),
+        "program_codes_rows": data.get("programs"),
+        "form_attributes": data.get("form"),
+    }
+
+
+# ==========================================================
+# rms_block_payloads（帶 cursor；dict / tuple cursor 都可）
+# ==========================================================
+def store_payloads(cur, payloads: dict, snapshot_id=None) -> int:
+    """
+    只寫 DB 還沒有的 hash（先查再補，大多數區塊沒改過 → 只有查詢）；回傳新增筆數。
+    有 snapshot_id → 同時記進 rms_snapshot_block_refs。已存在的 hash 用 FOR SHARE 讀，
+    交易結束前 collect_payloads() 刪不掉它（不會刪到剛被新快照重新用到的內容）。
+    """
+    if not payloads:
+        return 0
+    hashes = list(payloads)
+    existing = set()
+    for i in range(0, len(hashes), _PAYLOAD_CHUNK):
+        chunk = hashes[i:i + _PAYLOAD_CHUNK]
+        cur.execute(f"SELECT payload_hash FROM rms_block_payloads WHERE payload_hash IN ({', '.join(['%s'] * len(chunk))}) FOR SHARE", chunk)
+        for r in cur.fetchall():
+            existing.add(r["payload_hash"] if isinstance(r, dict) else r[0])
+    missing = [(h, payloads[h], len(payloads[h].encode("utf-8"))) for h in hashes if h not in existing]
+    if missing:
+        # INSERT IGNORE：同時有別的快照寫進同一個 hash 也沒關係（內容一定相同）
+        cur.executemany(
+            "INSERT IGNORE INTO rms_block_payloads (payload_hash, payload, byte_size, created_at) VALUES (%s,%s,%s,NOW())",
+            missing,
+        )
+    if snapshot_id is not None:
+        link_payloads(cur, snapshot_id, hashes)
+    return len(missing)
+
+
+def link_payloads(cur, snapshot_id, hashes) -> int:
+    hashes = sorted(set(hashes))
+    if hashes:
+        cur.executemany(
+            "INSERT IGNORE INTO rms_snapshot_block_refs (snapshot_id, payload_hash) VALUES (%s,%s)",
+            [(snapshot_id, h) for h in hashes],
+        )
+    return len(hashes)
+
+
+def envelope_hashes(blob) -> list:
+    """envelope 用到的區塊 hash（version 1 / 非 envelope → []）。"""
+    if not is_envelope(blob) or bytes(blob[3:4]) != bytes((VERSION_BLOCK_REFS,)):
+        return []
+    return sorted(set((_body(bytes(blob)).get("blocks") or {}).get("h") or []))
+
+
+def collect_payloads(conn, cur, grace_seconds=3600, limit=1000, dry_run=False) -> dict:
+    """
+    刪掉沒有任何快照參照的區塊內容（每批 limit 筆、每批 commit → 請給獨立連線，不要用 request 共用交易）。
+    1) 補參照：rms_snapshot_block_refs 上線前的 version 2 快照還沒有參照列 → 解 envelope 補上（只補一次）
+    2) 刪除：沒有參照、且建立超過 grace_seconds 的 hash
+    dry_run 只試算 2)；1) 照樣會補（不補的話舊快照用到的內容全都會被算成沒人用）。
+    """
+    stats = {"backfilled_snapshots": 0, "deleted": 0, "bytes": 0, "dry_run": bool(dry_run)}
+    last_id = 0
+    while True:
+        cur.execute(f"""
+          SELECT p.snapshot_id, p.payload_blob FROM rms_document_snapshot_payloads AS p
+          WHERE p.snapshot_id > %s AND p.payload_blob IS NOT NULL AND SUBSTRING(p.payload_blob, 1, 4) = %s
+            AND NOT EXISTS (SELECT 1 FROM rms_snapshot_block_refs AS r WHERE r.snapshot_id = p.snapshot_id)
+          ORDER BY p.snapshot_id
+          LIMIT {_PAYLOAD_CHUNK}
+        """, (last_id, MAGIC + bytes((VERSION_BLOCK_REFS,))))
+        rows = cur.fetchall() or []
+        for r in rows:
+            snapshot_id, blob = (r["snapshot_id"], r["payload_blob"]) if isinstance(r, dict) else r
+            link_payloads(cur, snapshot_id, envelope_hashes(blob))
+            last_id = snapshot_id
+        conn.commit()
+        stats["backfilled_snapshots"] += len(rows)
+        if len(rows) < _PAYLOAD_CHUNK:
+            break
+
+    orphan = """
+      FROM rms_block_payloads AS b
+      WHERE b.created_at < NOW() - INTERVAL %s SECOND
+        AND NOT EXISTS (SELECT 1 FROM rms_snapshot_block_refs AS r WHERE r.payload_hash = b.payload_hash)
+    """
+    if dry_run:
+        cur.execute(f"SELECT COUNT(*) AS n, COALESCE(SUM(b.byte_size), 0) AS size {orphan}", (int(grace_seconds),))
+        r = cur.fetchone()
+        n, size = (r["n"], r["size"]) if isinstance(r, dict) else r
+        stats["deleted"], stats["bytes"] = int(n), int(size)
+        return stats
+    while True:
+        cur.execute(f"SELECT b.payload_hash, b.byte_size {orphan} LIMIT %s", (int(grace_seconds), int(limit)))
+        rows = [(r["payload_hash"], r["byte_size"]) if isinstance(r, dict) else r for r in (cur.fetchall() or [])]
+        if not rows:
+            break
+        # 刪的當下再檢查一次參照（期間有新快照用到同一個 hash 就留著）
+        cur.execute(f"""
+          DELETE FROM rms_block_payloads
+          WHERE payload_hash IN ({', '.join(['%s'] * len(rows))})
+            AND NOT EXISTS (SELECT 1 FROM rms_snapshot_block_refs AS r WHERE r.payload_hash = rms_block_payloads.payload_hash)
+        """, [h for h, _ in rows])
+        kept = set()
+        if cur.rowcount != len(rows):
+            cur.execute(f"SELECT payload_hash FROM rms_block_payloads WHERE payload_hash IN ({', '.join(['%s'] * len(rows))})", [h for h, _ in rows])
+            kept = {r["payload_hash"] if isinstance(r, dict) else r[0] for r in cur.fetchall()}
+        conn.commit()
+        gone = [(h, n) for h, n in rows if h not in kept]
+        stats["deleted"] += len(gone)
+        stats["bytes"] += sum(int(n or 0) for _, n in gone)
+        if len(rows) < limit:
+            break
+    return stats
+
+
+def fetch_payloads(cur, hashes) -> dict:
+    out = {}
+    hashes = list(hashes)
+    for i in range(0, len(hashes), _PAYLOAD_CHUNK):
+        chunk = hashes[i:i + _PAYLOAD_CHUNK]
+        cur.execute(f"SELECT payload_hash, payload FROM rms_block_payloads WHERE payload_hash IN ({', '.join(['%s'] * len(chunk))})", chunk)
+        for r in cur.fetchall():
+            h, payload = (r["payload_hash"], r["payload"]) if isinstance(r, dict) else r
+            out[h] = json.loads(payload) if isinstance(payload, (str, bytes, bytearray)) else payload
+    return out
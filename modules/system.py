@@ -0,0 +1,51 @@
+# modules/system.py
+from __future__ import annotations
+from flask import Blueprint, jsonify
+
+import db as mysql_db
+import oracle_db
+from sync_state import load_sync_state, request_trigger
+from sync_scheduler import SYNC_NAME
+
+bp = Blueprint("system", __name__)
+
+
+# ==========================================================
+# 連線池狀態（維運用）：MySQL 單一池 + Oracle 各 alias
+# ==========================================================
+@bp.get("/pools")
+def pools():
+    try:
+        return jsonify({
+            "success": True,
+            "data": {
+                "mysql": mysql_db.pool_stats(),
+                "oracle": oracle_db.pool_stats(),
+            },
+        })
+    except Exception as e:
+        print(f"[system] pool stats error: {e}")
+        return jsonify({"success": False, "message": str(e)}), 500
+
+
+# ==========================================================
+# EIP 同步排程器（sync_scheduler.py）：狀態 / 手動觸發
+# ==========================================================
+@bp.get("/sync")
+def sync_status():
+    try:
+        return jsonify({"success": True, "data": load_sync_state(SYNC_NAME)})
+    except Exception as e:
+        print(f"[system] sync status error: {e}")
+        return jsonify({"success": False, "message": str(e)}), 500
+
+
+@bp.post("/sync/trigger")
+def sync_trigger():
+    """留旗標給 leader（下一次 poll 就跑），不在 API 行程裡直接同步。"""
+    try:
+        request_trigger(SYNC_NAME)
+        return jsonify({"success": True, "message": "sync requested"}), 202
+    except Exception as e:
+        print(f"[system] sync trigger error: {e}")
+        return jsonify({"success": False, "message": str(e)}), 500
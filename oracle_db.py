@@ -1,6 +1,8 @@
 # oracle_db.py
 import sys
 import os
+import time
+import threading
 import oracledb
 from contextlib import contextmanager
 
@@ -31,7 +33,54 @@ DB_CONFIGS = {
     # ... 第三個資料庫
 }
 
+# --- POOL SIZING（每個 alias 各自設定；環境變數 ORACLE_POOL_<ALIAS>_MIN / _MAX / _INCREMENT 可覆蓋）---
+# machine_db 被 /mes 大量扇出查詢，item_db 幾乎閒置 → 預設就分開給
+_POOL_DEFAULTS = {
+    "default":    {"min": 1, "max": 8,  "increment": 1},
+    "machine_db": {"min": 2, "max": 16, "increment": 2},
+    "item_db":    {"min": 1, "max": 4,  "increment": 1},
+}
+
+_GETMODES = {
+    "wait": oracledb.POOL_GETMODE_WAIT,
+    "nowait": oracledb.POOL_GETMODE_NOWAIT,
+    "forceget": oracledb.POOL_GETMODE_FORCEGET,
+    "timedwait": oracledb.POOL_GETMODE_TIMEDWAIT,
+}
+
+
+def _env_int(name, default):
+    try:
+        return int(os.getenv(name, default))
+    except (TypeError, ValueError):
+        return default
+
+
+def pool_config(db_alias):
+    """組出某 alias 的 pool 參數（env 優先，其次 _POOL_DEFAULTS）。"""
+    base = _POOL_DEFAULTS.get(db_alias, _POOL_DEFAULTS["default"])
+    key = db_alias.upper()
+    getmode = os.getenv(f"ORACLE_POOL_{key}_GETMODE", os.getenv("ORACLE_POOL_GETMODE", "timedwait")).lower()
+    return {
+        "min": _env_int(f"ORACLE_POOL_{key}_MIN", base["min"]),
+        "max": _env_int(f"ORACLE_POOL_{key}_MAX", base["max"]),
+        "increment": _env_int(f"ORACLE_POOL_{key}_INCREMENT", base["increment"]),
+        "getmode": getmode if getmode in _GETMODES else "timedwait",
+        # 借連線最多等幾毫秒（只在 timedwait 生效）
+        "wait_timeout": _env_int(f"ORACLE_POOL_{key}_WAIT_TIMEOUT", _env_int("ORACLE_POOL_WAIT_TIMEOUT", 5000)),
+        "timeout": _env_int("ORACLE_POOL_IDLE_TIMEOUT", 60),   # 閒置 session 幾秒後收掉
+    }
+
+
 _pools = {}
+_pools_pid = os.getpid()   # 建 pool 的行程；fork 出來的子行程不能沿用父行程的 OCI pool / session
+_pools_lock = threading.Lock()
+_acquire_stats = {}      # alias -> {acquired, waited, wait_total_ms, wait_max_ms, failed}
+_stats_lock = threading.Lock()
+
+# 借連線超過這個毫秒數才算一次「等待」
+_WAIT_THRESHOLD_MS = 5
+
 
 def _init_client_once():
     # Thick mode 只需要初始化一次
@@ -41,28 +90,99 @@ def _init_client_once():
         pass # 避免重複初始化報錯
 
 def get_pool(db_alias="default"):
-    """根據 alias 取得對應的 Connection Pool"""
-    global _pools
+    """根據 alias 取得對應的 Connection Pool（fork 後的子行程會自建，同 db.get_pool）"""
+    global _pools, _pools_pid
     
     if db_alias not in DB_CONFIGS:
         raise ValueError(f"Unknown DB alias: {db_alias}")
 
-    if db_alias not in _pools:
-        _init_client_once()
-        conf = DB_CONFIGS[db_alias]
-        # 建立該資料庫的 Pool
-        _pools[db_alias] = oracledb.create_pool(
-            user=conf["user"],
-            password=conf["password"],
-            dsn=conf["dsn"],
-            min=1, max=8, increment=1, homogeneous=True, timeout=60, stmtcachesize=200
-        )
+    pool = _pools.get(db_alias)
+    if pool is not None and _pools_pid == os.getpid():
+        return pool
+
+    with _pools_lock:
+        if _pools_pid != os.getpid():
+            # 繼承來的 handle 不 close（會動到父行程的 session），直接丟掉重建
+            _pools, _pools_pid = {}, os.getpid()
+            with _stats_lock:
+                _acquire_stats.clear()
+        if db_alias not in _pools:
+            _init_client_once()
+            conf = DB_CONFIGS[db_alias]
+            pc = pool_config(db_alias)
+            # 建立該資料庫的 Pool
+            _pools[db_alias] = oracledb.create_pool(
+                user=conf["user"],
+                password=conf["password"],
+                dsn=conf["dsn"],
+                min=pc["min"], max=pc["max"], increment=pc["increment"],
+                homogeneous=True, timeout=pc["timeout"], stmtcachesize=200,
+                getmode=_GETMODES[pc["getmode"]], wait_timeout=pc["wait_timeout"],
+            )
     return _pools[db_alias]
 
+
+def warmup_pools(aliases=None):
+    """啟動時先把各 alias 的 pool 建好（含 thick client 初始化與 min 條 session），
+    不讓第一個 request 付這筆成本；某個 DB 連不上只記 log，不擋啟動。"""
+    result = {}
+    for alias in (aliases or DB_CONFIGS.keys()):
+        t0 = time.monotonic()
+        try:
+            pool = get_pool(alias)
+            result[alias] = {"ok": True, "opened": pool.opened, "ms": round((time.monotonic() - t0) * 1000, 1)}
+        except Exception as e:
+            print(f"[oracle pool] warmup {alias} failed: {e}")
+            result[alias] = {"ok": False, "error": str(e)}
+    return result
+
+
+def _record_acquire(db_alias, wait_ms, failed=False):
+    with _stats_lock:
+        st = _acquire_stats.setdefault(db_alias, {
+            "acquired": 0, "waited": 0, "wait_total_ms": 0.0, "wait_max_ms": 0.0, "failed": 0,
+        })
+        if failed:
+            st["failed"] += 1   # timedwait 逾時 / nowait 借不到 / 連線失敗
+            return
+        st["acquired"] += 1
+        st["wait_total_ms"] += wait_ms
+        st["wait_max_ms"] = max(st["wait_max_ms"], wait_ms)
+        if wait_ms >= _WAIT_THRESHOLD_MS:
+            st["waited"] += 1
+
+
+def pool_stats():
+    """每個 alias 的 busy / open / 等待統計（尚未建立的 pool 只回設定值）。"""
+    out = {}
+    for alias in DB_CONFIGS:
+        pc = pool_config(alias)
+        info = {"created": alias in _pools, "min": pc["min"], "max": pc["max"],
+                "increment": pc["increment"], "getmode": pc["getmode"], "wait_timeout_ms": pc["wait_timeout"]}
+        pool = _pools.get(alias)
+        if pool is not None:
+            info.update({"busy": pool.busy, "open": pool.opened})
+        with _stats_lock:
+            st = dict(_acquire_stats.get(alias) or {})
+        if st:
+            st["wait_avg_ms"] = round(st["wait_total_ms"] / st["acquired"], 3) if st["acquired"] else 0.0
+            st["wait_total_ms"] = round(st["wait_total_ms"], 3)
+            st["wait_max_ms"] = round(st["wait_max_ms"], 3)
+        info["acquire"] = st
+        out[alias] = info
+    return out
+
 @contextmanager
 def ora_conn(db_alias="default"):
     pool = get_pool(db_alias)
-    with pool.acquire() as conn:
+    t0 = time.monotonic()
+    try:
+        conn = pool.acquire()
+    except oracledb.DatabaseError:
+        _record_acquire(db_alias, 0, failed=True)
+        raise
+    _record_acquire(db_alias, (time.monotonic() - t0) * 1000)
+    with conn:
         yield conn
 
 @contextmanager
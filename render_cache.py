@@ -0,0 +1,196 @@
+# render_cache.py
+#
+# 渲染結果快取（content-addressed）：同一份 payload 用同一個渲染器 + 同一版範本，產出的 Word 一定一樣，
+# 直接回上次的檔案，不再重跑 python-docx。
+#   key = sha256(renderer, 渲染程式碼版本, 範本檔名 + mtime, protect, 制定日期, 正規化後的 payload)
+#   渲染程式碼版本 = renderer 模組 + 共用輔助模組原始碼的 hash → 修正 DocxDefinition*_ 部署後舊快取自然失效（快取目錄跨重啟保留）
+#   檔案放 RENDER_CACHE_DIR/<key 前 2 碼>/<key>.docx，命中時更新 mtime（LRU），
+#   總大小超過 RENDER_CACHE_MAX_MB 就從最久沒用的開始刪。
+# 快照不可變 → 簽核期間反覆開同一份快照預覽幾乎都命中；草稿沒改也會命中。
+
+import io
+import os
+import json
+import time
+import uuid
+import hashlib
+import threading
+import importlib.util
+from datetime import datetime
+
+from config import RENDER_CACHE
+from render_worker import render_docx_bytes, RENDERERS
+
+_SUFFIX = ".docx"
+_TMP_SUFFIX = ".part"     # 渲染中的暫存檔（不算進快取大小、不會被 evict）
+_EVICT_GRACE = 60        # 秒：剛命中 / 剛寫入的檔案不刪，避免 send_file 前被清掉
+
+# 各 renderer 都會用到、改了會影響輸出的模組（階層編號 / 範本 / 圖片快取）
+_RENDERER_SHARED_MODULES = ("docx_cache", "modules.block_tree")
+_renderer_versions = {}
+
+
+def renderer_version(renderer):
+    """renderer 模組 + 共用模組原始碼的 sha256（每個 renderer 算一次；只讀檔，不 import）。"""
+    v = _renderer_versions.get(renderer)
+    if v is None:
+        h = hashlib.sha256()
+        for module_name in (RENDERERS[renderer][0], *_RENDERER_SHARED_MODULES):
+            spec = importlib.util.find_spec(module_name)
+            h.update(module_name.encode("utf-8"))
+            with open(spec.origin, "rb") as f:
+                h.update(f.read())
+        v = _renderer_versions[renderer] = h.hexdigest()
+    return v
+
+
+class RenderCache:
+    def __init__(self, root, max_bytes):
+        self.root = root
+        self.max_bytes = int(max_bytes)
+        self._lock = threading.Lock()
+        self._inflight = {}       # key -> Lock：同一個 key 同時只渲染一次
+        self._size = None         # 目前總大小（第一次用到時掃目錄）
+        self._stats = {"hits": 0, "misses": 0, "evicted": 0}
+
+    # ---- key ----
+    @staticmethod
+    def make_key(renderer, template, data, protect=True):
+        st = os.stat(template)
+        render_date = data.get("render_date") or datetime.now().strftime("%Y/%m/%d")   # 渲染器同樣的 fallback
+        raw = json.dumps(
+            [renderer, renderer_version(renderer), os.path.basename(template), st.st_mtime_ns, bool(protect), render_date, data],
+            sort_keys=True, ensure_ascii=False, separators=(",", ":"), default=str,
+        )
+        return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+    def path_for(self, key):
+        return os.path.join(self.root, key[:2], key + _SUFFIX)
+
+    # ---- size / eviction ----
+    def _scan(self):
+        entries = []
+        for dirpath, _, files in os.walk(self.root):
+            for f in files:
+                if not f.endswith(_SUFFIX):
+                    continue
+                p = os.path.join(dirpath, f)
+                try:
+                    st = os.stat(p)
+                except FileNotFoundError:
+                    continue
+                entries.append((st.st_mtime, st.st_size, p))
+        return entries
+
+    def _ensure_size(self):
+        if self._size is None:
+            self._size = sum(size for _, size, _ in self._scan())
+
+    def _evict(self):
+        """超過上限 → 依 mtime（最近一次命中 / 寫入）由舊到新刪到上限的 90%。"""
+        with self._lock:
+            self._ensure_size()
+            if self._size <= self.max_bytes:
+                return
+        entries = sorted(self._scan())
+        total = sum(size for _, size, _ in entries)
+        target = int(self.max_bytes * 0.9)
+        now = time.time()
+        removed = 0
+        for mtime, size, p in entries:
+            if total <= target:
+                break
+            if now - mtime < _EVICT_GRACE:
+                continue
+            try:
+                os.remove(p)
+                total -= size
+                removed += 1
+            except FileNotFoundError:
+                total -= size
+            except OSError as e:
+                print(f"[render_cache] evict {p} failed: {e}")
+        with self._lock:
+            self._size = total
+            self._stats["evicted"] += removed
+
+    # ---- public ----
+    def get(self, key):
+        """命中 → 回傳檔案路徑（並 touch 當作最近使用）；沒有 → None。"""
+        p = self.path_for(key)
+        try:
+            os.utime(p)
+        except FileNotFoundError:
+            return None
+        with self._lock:
+            self._stats["hits"] += 1
+        return p
+
+    def put(self, key, blob):
+        """寫入快取：先寫暫存檔再原子 rename，讀的人不會看到寫一半的檔。"""
+        p = self.path_for(key)
+        with self._lock:
+            self._ensure_size()           # 先掃（不含這個新檔），下面再加上它的大小
+        os.makedirs(os.path.dirname(p), exist_ok=True)
+        tmp = os.path.join(self.root, f".tmp-{uuid.uuid4().hex}{_TMP_SUFFIX}")
+        try:
+            with open(tmp, "wb") as f:
+                f.write(blob)
+            os.replace(tmp, p)
+        finally:
+            if os.path.exists(tmp):
+                os.remove(tmp)
+        with self._lock:
+            self._size += len(blob)
+            over = self._size > self.max_bytes
+        if over:
+            self._evict()
+        return p
+
+    def get_or_render(self, key, render):
+        """
+        有快取 → 回傳檔案路徑；沒有 → 呼叫 render() 取得 docx bytes，寫進快取後回傳 BytesIO（這次直接從記憶體送）。
+        同一個 key 同時多個請求只會渲染一次，其餘等它做完直接命中。
+        """
+        hit = self.get(key)
+        if hit:
+            return hit
+        with self._lock:
+            lock = self._inflight.setdefault(key, threading.Lock())
+        with lock:
+            try:
+                hit = self.get(key)
+                if hit:
+                    return hit
+                with self._lock:
+                    self._stats["misses"] += 1
+                blob = render()
+                try:
+                    self.put(key, blob)
+                except OSError as e:
+                    print(f"[render_cache] write {key} failed: {e}")   # 寫不進快取不影響這次回應
+                return io.BytesIO(blob)
+            finally:
+                with self._lock:
+                    self._inflight.pop(key, None)
+
+    def stats(self):
+        with self._lock:
+            self._ensure_size()
+            s = dict(self._stats)
+            s.update({"bytes": self._size, "max_bytes": self.max_bytes, "enabled": RENDER_CACHE["enabled"]})
+        return s
+
+
+render_cache = RenderCache(RENDER_CACHE["dir"], RENDER_CACHE["max_mb"] * 1024 * 1024)
+
+
+def cached_docx(renderer, template, data, protect=True):
+    """
+    渲染（或直接命中快取）一份 Word，回傳可直接丟給 send_file 的東西：
+      命中 → 快取檔路徑；未命中 / 快取關閉 → 記憶體內的 BytesIO。呼叫端都不需要刪檔。
+    """
+    if not RENDER_CACHE["enabled"]:
+        return render_docx_bytes(renderer, data, template, protect=protect)
+    key = render_cache.make_key(renderer, template, data, protect)
+    return render_cache.get_or_render(key, lambda: render_docx_bytes(renderer, data, template, protect=protect).getvalue())
@@ -0,0 +1,107 @@
+# render_worker.py
+#
+# Word 渲染（python-docx，純 CPU）移出 Flask request thread：
+#   - 背後是 ProcessPoolExecutor（RENDER_WORKERS 個子行程），不跟 API thread 搶 GIL
+#   - 每個 worker 啟動時先載好範本 + 保護雜湊（docx_cache），之後每份文件直接 deepcopy 範本
+#   - 外面包一層 JobQueue：有上限（RENDER_QUEUE_MAX）、有 job id，給 /render/jobs 非同步 API 用
+#   - render_docx() 是同步包裝：原本 /preview/*、/generate/*、/view/* 的流程不變，只是改成等 worker 做完
+# RENDER_WORKERS=0 → 不開子行程，照舊在呼叫端 thread 內直接渲染（開發 / 除錯用）。
+
+import io
+import os
+import glob
+import importlib
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+
+from config import RENDER
+from job_queue import JobQueue, QueueFull  # noqa: F401（QueueFull 給呼叫端 import）
+
+# renderer 名稱 → (module, function)；函式簽章皆為 fn(out_path, data, template, protect=True)
+RENDERERS = {
+    "framework": ("DocxDefinition_", "get_docx_"),
+    "no_framework": ("DocxDefinitionNoFramework_", "get_docx_without_framework_"),
+}
+
+TEMPLATE_DIR = "docx-template"
+
+
+def _renderer(name):
+    module_name, fn_name = RENDERERS[name]
+    return getattr(importlib.import_module(module_name), fn_name)
+
+
+def warm_renderers():
+    """載入 renderer 模組、預先解析範本、先算好文件保護雜湊（worker initializer / 單行程模式共用）。"""
+    from docx_cache import warm_templates, protection_hash
+    from config import DOCX_PROTECTION
+
+    templates = sorted(glob.glob(os.path.join(TEMPLATE_DIR, "*Document*.docx")))
+    for name, (module_name, _) in RENDERERS.items():
+        try:
+            mod = importlib.import_module(module_name)
+            warm_templates(templates, prepare=mod._prepare_template)
+            password = DOCX_PROTECTION["password"] or mod.DEFAULT_PROTECTION_PASSWORD
+            protection_hash(password, DOCX_PROTECTION["spin_count"], mod.generate_word_password_hash,
+                            DOCX_PROTECTION["rotate_seconds"])
+        except Exception as e:
+            print(f"[render_worker] warmup {name} failed: {e}")
+
+
+def _init_worker():
+    print(f"[render_worker] worker started (pid={os.getpid()})")
+    warm_renderers()
+
+
+def _render_job(renderer, out_path, data, template, protect=True):
+    """在 worker 行程內執行：out_path 有值 → 寫檔並回傳路徑；None → 回傳 docx bytes（不落地）。"""
+    out = _renderer(renderer)(out_path, data, template, protect=protect)
+    return out.getvalue() if out_path is None else out_path
+
+
+def _make_executor():
+    if RENDER["workers"] <= 0:
+        return ThreadPoolExecutor(max_workers=1, thread_name_prefix="render")
+    return ProcessPoolExecutor(
+        max_workers=RENDER["workers"],
+        mp_context=multiprocessing.get_context(RENDER["mp_context"]),
+        initializer=_init_worker,
+    )
+
+
+def _remove_output(job):
+    path = job.meta.get("out_path")
+    if path and job.meta.get("owned") and os.path.exists(path):
+        os.remove(path)
+
+
+render_queue = JobQueue("render", _make_executor, max_pending=RENDER["queue_max"],
+                        ttl=RENDER["job_ttl"], on_expire=_remove_output)
+
+
+def submit_render(renderer, out_path, data, template, protect=True, meta=None, owned=True):
+    """
+    非同步：排入渲染工作，回傳 job id（佇列滿丟 QueueFull）。
+    owned=True → 這個輸出檔歸佇列管，job 過期時一併刪除。
+    """
+    if renderer not in RENDERERS:
+        raise ValueError(f"unknown renderer: {renderer}")
+    info = dict(meta or {}, renderer=renderer, out_path=out_path, owned=owned)
+    return render_queue.submit(_render_job, renderer, out_path, data, template, protect, meta=info)
+
+
+def render_docx(renderer, out_path, data, template, protect=True):
+    """同步包裝：交給 worker 渲染並等它做完（逾時 / 失敗照原樣丟例外）。
+    out_path=None → 回傳 bytes（見 render_docx_bytes）；否則寫到 out_path 並回傳路徑。"""
+    if RENDER["workers"] <= 0:
+        return _render_job(renderer, out_path, data, template, protect)
+    job_id = submit_render(renderer, out_path, data, template, protect, owned=False)
+    try:
+        return render_queue.wait(job_id, timeout=RENDER["timeout"])
+    finally:
+        render_queue.discard(job_id)
+
+
+def render_docx_bytes(renderer, data, template, protect=True):
+    """同步渲染成記憶體內的 BytesIO（預覽 / 檢視直接 send_file，不寫暫存檔）。"""
+    return io.BytesIO(render_docx(renderer, None, data, template, protect))
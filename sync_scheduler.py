@@ -0,0 +1,146 @@
+# sync_scheduler.py
+#
+# EIP 同步排程器（獨立行程，取代原本 __main__ fork 出來的固定間隔 sync_loop）：
+#   python sync_scheduler.py          → 常駐排程
+#   python sync_scheduler.py --once   → 立刻跑一輪（一樣受單輪互斥鎖保護）
+#
+#   - leader lease：MySQL GET_LOCK（sync_state.LeaderLease），開幾個都只有一個真的在排，其餘每 SYNC_POLL 秒試著接手
+#   - 間隔 SYNC_INTERVAL 秒 ±SYNC_JITTER（多台不會對齊同一秒打 Oracle）；
+#     接手時依 DB 記錄的上一輪結束時間排下一輪，不會換 leader 就多跑一次
+#   - 失敗（Oracle / MySQL 錯誤、sync_eip 回 Success=False）→ 指數 backoff：SYNC_BACKOFF_BASE × 2^(連續失敗-1)，上限 SYNC_BACKOFF_MAX
+#   - 手動觸發：POST /system/sync/trigger 在 rms_sync_state 留旗標，leader 下一次 poll 就跑
+#   - 每輪寫指標到 rms_sync_state（耗時、各類筆數、錯誤數），GET /system/sync 查
+# 真正的同步邏輯仍是 modules.docs.sync_eip（手動 POST /docs/sync-eip 也可以，同一把單輪鎖，不會同時跑兩輪）。
+
+import sys
+import time
+import random
+import signal
+import datetime
+
+from config import SYNC_SCHEDULER
+from sync_state import LeaderLease, identity, heartbeat, take_trigger, record_run, seconds_since_last_run
+
+SYNC_NAME = "eip"
+LEADER_LOCK = "rms_sync_eip_leader"
+
+_stop = False
+
+
+def _on_signal(signum, frame):
+    global _stop
+    _stop = True
+    print(f"[sync scheduler] signal {signum}, stopping after current step")
+
+
+def next_delay(failures, interval=None):
+    """下一輪距今幾秒：成功 → interval ± jitter；連續失敗 n 次 → backoff_base × 2^(n-1)（上限 backoff_max）± jitter。"""
+    base = SYNC_SCHEDULER["interval"] if interval is None else interval
+    if failures > 0:
+        base = min(SYNC_SCHEDULER["backoff_max"], SYNC_SCHEDULER["backoff_base"] * 2 ** (failures - 1))
+    j = SYNC_SCHEDULER["jitter"]
+    return max(1.0, base * random.uniform(1 - j, 1 + j))
+
+
+def _unpack(resp):
+    """view function 回傳值（Response 或 (Response, status)）→ (status, json)。"""
+    status = None
+    if isinstance(resp, tuple):
+        resp, status = resp[0], resp[1]
+    if resp is None:
+        return status or 500, None
+    return status or resp.status_code, resp.get_json(silent=True)
+
+
+def run_once():
+    """
+    跑一輪 sync_eip（需在 app context 內）並寫指標。
+    回傳 "ok" / "error" / "skipped"（另一輪正在跑，例如有人手動打 /docs/sync-eip）。
+    """
+    from modules.docs import sync_eip
+
+    started_at = datetime.datetime.now()
+    t = time.perf_counter()
+    data, error = None, None
+    try:
+        status, data = _unpack(sync_eip())
+        if status == 409:
+            print("[sync scheduler] another cycle is running, skipped")
+            return "skipped"
+        ok = status == 200 and bool(data) and data.get("Success") is True
+        if not ok:
+            error = (data or {}).get("error") or f"HTTP {status}"
+    except Exception as e:
+        ok, error = False, repr(e)
+    duration_ms = (time.perf_counter() - t) * 1000
+
+    print(f"[sync scheduler] cycle {'ok' if ok else 'ERROR'} in {duration_ms:.0f} ms: {data if ok else error}")
+    try:
+        record_run(SYNC_NAME, started_at, duration_ms, ok, result=data, error=error)
+    except Exception as e:
+        print(f"[sync scheduler] record metrics failed: {e}")
+    return "ok" if ok else "error"
+
+
+def run(interval_seconds=None):
+    """常駐排程迴圈（自己建 app / app_context）。"""
+    from app import create_app
+
+    for sig in (signal.SIGTERM, signal.SIGINT):
+        try:
+            signal.signal(sig, _on_signal)
+        except ValueError:   # 不在 main thread（例如被嵌在別的行程裡）→ 靠 daemon 結束
+            pass
+
+    interval = interval_seconds or SYNC_SCHEDULER["interval"]
+    poll = max(1, SYNC_SCHEDULER["poll"])
+    lease = LeaderLease(LEADER_LOCK)
+    me = identity()
+    failures, next_at = 0, None
+
+    app = create_app()
+    with app.app_context():
+        print(f"[sync scheduler] started ({me}, interval={interval}s, poll={poll}s)")
+        while not _stop:
+            if not lease.hold():
+                next_at = None          # 之後當上 leader 再依上一輪結束時間排
+                time.sleep(poll)
+                continue
+
+            try:
+                heartbeat(SYNC_NAME, me)
+                if next_at is None:
+                    since = seconds_since_last_run(SYNC_NAME)
+                    next_at = time.monotonic() + (0 if since is None else max(0, interval - since))
+                triggered = take_trigger(SYNC_NAME)
+            except Exception as e:
+                print(f"[sync scheduler] state check failed: {e}")
+                time.sleep(poll)
+                continue
+
+            if triggered or time.monotonic() >= next_at:
+                if triggered:
+                    print("[sync scheduler] manual trigger")
+                outcome = run_once()
+                if outcome == "skipped":
+                    next_at = time.monotonic() + poll
+                else:
+                    failures = 0 if outcome == "ok" else failures + 1
+                    next_at = time.monotonic() + next_delay(failures, interval)
+                    if failures:
+                        print(f"[sync scheduler] {failures} consecutive failure(s), retry in {next_at - time.monotonic():.0f}s")
+
+            time.sleep(max(0.0, min(poll, next_at - time.monotonic())))
+
+    lease.release()
+    print("[sync scheduler] stopped")
+
+
+if __name__ == "__main__":
+    if "--once" in sys.argv[1:]:
+        from app import create_app
+
+        with create_app().app_context():
+            run_once()
+    else:
+        run()
@@ -0,0 +1,189 @@
+# sync_state.py
+#
+# 背景同步作業的進度與指標（MySQL rms_sync_state，一個作業一筆，sync_name 為 key）：
+#   - watermark：上一次「整輪成功」的開始時間（來源端時鐘，例如 Oracle SYSDATE），
+#     下一輪增量只看 watermark - lookback 之後有異動的資料
+#   - last_full_at：上一次全量對帳（不加時間條件）的時間
+#   - last_* / total_* / consecutive_failures：每輪結果（sync_scheduler 寫，/system/sync 讀）
+#   - trigger_requested_at：POST /system/sync/trigger 留的「馬上跑一次」請求，leader 取走後清掉
+#   - leader / leader_heartbeat_at：目前持有 leader lease 的行程（host:pid）
+# 同步中途失敗就不推進 watermark，下一輪自然從舊的 watermark 重來（各步驟本身可重跑）。
+#
+# 另外兩種 MySQL GET_LOCK（鎖綁在 session 上，連線斷了 server 自動釋放，不會留死鎖）：
+#   - mysql_lock()：單輪互斥（排程器與手動 /docs/sync-eip 不會同時跑）；request 內沿用 request 的連線
+#   - LeaderLease：整個行程生命週期持有，多台 / 多 worker 只有一個排程器真的在排
+
+import os
+import json
+import socket
+from contextlib import contextmanager
+
+from db import db, session_cursor, dedicated_connection
+
+_STATE_COLUMNS = (
+    "watermark", "last_full_at", "last_started_at", "last_finished_at", "last_duration_ms", "last_status",
+    "last_error", "last_result", "consecutive_failures", "total_runs", "total_errors",
+    "trigger_requested_at", "leader", "leader_heartbeat_at", "updated_at",
+)
+
+
+def identity():
+    """本行程識別（寫進 leader 欄位）。"""
+    return f"{socket.gethostname()}:{os.getpid()}"
+
+
+def load_sync_state(name):
+    """回傳 rms_sync_state 的整列（last_result 解成 dict）；還沒跑過 → {}。"""
+    with db(dict_cursor=True) as (conn, cur):
+        cur.execute(f"SELECT {', '.join(_STATE_COLUMNS)} FROM rms_sync_state WHERE sync_name=%s", (name,))
+        row = cur.fetchone() or {}
+    if isinstance(row.get("last_result"), (str, bytes)):
+        try:
+            row["last_result"] = json.loads(row["last_result"])
+        except ValueError:
+            pass
+    return row
+
+
+def save_sync_state(name, watermark, full=False):
+    """整輪成功後呼叫：推進 watermark；full=True 時 last_full_at 一起更新。"""
+    with db() as (conn, cur):
+        cur.execute("""
+          INSERT INTO rms_sync_state (sync_name, watermark, last_full_at, updated_at)
+          VALUES (%s, %s, %s, NOW())
+          ON DUPLICATE KEY UPDATE
+            watermark = VALUES(watermark),
+            last_full_at = COALESCE(VALUES(last_full_at), last_full_at),
+            updated_at = NOW()
+        """, (name, watermark, watermark if full else None))
+        conn.commit()
+
+
+# ==========================================================
+# 指標 / 手動觸發 / leader 心跳
+# ==========================================================
+def record_run(name, started_at, duration_ms, ok, result=None, error=None):
+    """每輪結束寫一次（成功 / 失敗都寫）。"""
+    with db() as (conn, cur):
+        cur.execute("""
+          INSERT INTO rms_sync_state (sync_name, last_started_at, last_finished_at, last_duration_ms, last_status,
+                                      last_error, last_result, consecutive_failures, total_runs, total_errors, updated_at)
+          VALUES (%s, %s, NOW(), %s, %s, %s, %s, %s, 1, %s, NOW())
+          ON DUPLICATE KEY UPDATE
+            last_started_at = VALUES(last_started_at),
+            last_finished_at = NOW(),
+            last_duration_ms = VALUES(last_duration_ms),
+            last_status = VALUES(last_status),
+            last_error = VALUES(last_error),
+            last_result = VALUES(last_result),
+            consecutive_failures = IF(VALUES(last_status) = 'ok', 0, consecutive_failures + 1),
+            total_runs = total_runs + 1,
+            total_errors = total_errors + VALUES(total_errors),
+            updated_at = NOW()
+        """, (
+            name, started_at, int(duration_ms), "ok" if ok else "error",
+            None if ok else str(error)[:2000], json.dumps(result, ensure_ascii=False, default=str) if result is not None else None,
+            0 if ok else 1, 0 if ok else 1,
+        ))
+        conn.commit()
+
+
+def seconds_since_last_run(name):
+    """距離上一輪結束幾秒（DB 時鐘）；沒跑過 → None。"""
+    with db() as (conn, cur):
+        cur.execute("SELECT TIMESTAMPDIFF(SECOND, last_finished_at, NOW()) FROM rms_sync_state WHERE sync_name=%s", (name,))
+        row = cur.fetchone()
+    return row[0] if row else None
+
+
+def request_trigger(name):
+    with db() as (conn, cur):
+        cur.execute("""
+          INSERT INTO rms_sync_state (sync_name, trigger_requested_at, updated_at) VALUES (%s, NOW(), NOW())
+          ON DUPLICATE KEY UPDATE trigger_requested_at = NOW(), updated_at = NOW()
+        """, (name,))
+        conn.commit()
+
+
+def take_trigger(name):
+    """有待處理的手動觸發 → 清掉並回 True（條件式 UPDATE，只有一個人拿得到）。"""
+    with db() as (conn, cur):
+        cur.execute("UPDATE rms_sync_state SET trigger_requested_at = NULL WHERE sync_name=%s AND trigger_requested_at IS NOT NULL", (name,))
+        taken = cur.rowcount == 1
+        conn.commit()
+    return taken
+
+
+def heartbeat(name, leader):
+    with db() as (conn, cur):
+        cur.execute("""
+          INSERT INTO rms_sync_state (sync_name, leader, leader_heartbeat_at, updated_at) VALUES (%s, %s, NOW(), NOW())
+          ON DUPLICATE KEY UPDATE leader = VALUES(leader), leader_heartbeat_at = NOW()
+        """, (name, leader))
+        conn.commit()
+
+
+# ==========================================================
+# MySQL GET_LOCK
+# ==========================================================
+@contextmanager
+def mysql_lock(name, timeout=0):
+    """
+    with mysql_lock("rms_sync_eip_cycle") as acquired: ...
+    timeout 秒內拿不到 → acquired=False（呼叫端自己決定要不要跳過）。
+    在 request 內掛在 request 共用的連線上（不另外佔一條池連線），否則借一條池連線持有到區塊結束。
+    """
+    with session_cursor() as cur:
+        cur.execute("SELECT GET_LOCK(%s, %s)", (name, timeout))
+        acquired = (cur.fetchone() or [0])[0] == 1
+        try:
+            yield acquired
+        finally:
+            if acquired:
+                cur.execute("SELECT RELEASE_LOCK(%s)", (name,))
+                cur.fetchone()
+
+
+class LeaderLease:
+    """
+    行程層級的 leader lease：專用連線（不進池）上 GET_LOCK，連線活著就一直是 leader。
+    hold() 每次排程迴圈呼叫：確認自己還握著鎖（IS_USED_LOCK = CONNECTION_ID()），沒有就試著搶。
+    """
+
+    def __init__(self, name):
+        self.name = name
+        self.conn = None
+        self.leader = False
+
+    def _query(self, sql):
+        cur = self.conn.cursor()
+        try:
+            cur.execute(sql, (self.name,))
+            return (cur.fetchone() or [None])[0]
+        finally:
+            cur.close()
+
+    def hold(self):
+        try:
+            if self.conn is None:
+                self.conn = dedicated_connection()
+            if self.leader and self._query("SELECT IS_USED_LOCK(%s) = CONNECTION_ID()") == 1:
+                return True
+            was_leader, self.leader = self.leader, self._query("SELECT GET_LOCK(%s, 0)") == 1
+            if self.leader != was_leader:
+                print(f"[sync leader] {identity()} {'acquired' if self.leader else 'lost'} lease {self.name}")
+            return self.leader
+        except Exception as e:
+            print(f"[sync leader] lease check failed: {e}")
+            self.release()
+            return False
+
+    def release(self):
+        """關連線 = server 端自動釋放鎖。"""
+        self.leader = False
+        if self.conn is not None:
+            try:
+                self.conn.close()
+            except Exception:
+                pass
+            self.conn = None